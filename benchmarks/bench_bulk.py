@@ -0,0 +1,47 @@
+"""
+Insert throughput of POST /people (one row per request) against POST /people/bulk.
+
+    $ python benchmarks/bench_bulk.py [rows]
+"""
+import json
+import sys
+import time
+
+from common import people_rows, setup_app
+
+
+def rows_per_second(rows, send):
+    started = time.perf_counter()
+    send(rows)
+    return len(rows) / (time.perf_counter() - started)
+
+
+def main(count):
+    app, db = setup_app()
+    client = app.test_client()
+
+    def single(rows):
+        for row in rows:
+            client.post("/people", json=row)
+
+    def bulk_json(rows):
+        for start in range(0, len(rows), 5000):
+            client.post("/people/bulk", json=rows[start:start + 5000])
+
+    def bulk_ndjson(rows):
+        client.post("/people/bulk", data="\n".join(json.dumps(row) for row in rows),
+                    content_type="application/x-ndjson")
+
+    offset = 1
+    print(f"{'endpoint':>26} {'rows/sec':>12}")
+    for label, send in (("POST /people", single), ("POST /people/bulk", bulk_json),
+                        ("POST /people/bulk ndjson", bulk_ndjson)):
+        rows = people_rows(count, offset)
+        for row in rows:
+            del row["id"]
+        offset += count
+        print(f"{label:>26} {rows_per_second(rows, send):>12.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,52 @@
+"""
+CPU cost against bytes saved of the response encodings (see src/compress.py) at several levels,
+on the JSON body of GET /people and GET /planets. br and zstd are skipped when brotli or
+zstandard aren't installed.
+
+    $ python benchmarks/bench_compression.py [--rows 10000]
+
+"stream" rows compress the same body in chunks of STREAM_BATCH_SIZE rows with a flush after
+every chunk, like a ?stream=1 response.
+"""
+import argparse
+
+from common import people_rows, planets_rows, setup_app, timed
+
+LEVELS = {"gzip": (1, 6, 9), "br": (1, 4, 6, 11), "zstd": (1, 3, 9, 19)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    app, _ = setup_app()
+    from compress import Brotli, Gzip, Zstd
+    from models import People, Planets
+    from utils import STREAM_BATCH_SIZE
+
+    print(f"{'payload':>8} {'encoding':>8} {'level':>6} {'mode':>7} {'ms':>8} {'MB/s':>8} {'bytes':>10} {'ratio':>6}")
+    for model, rows in ((People, people_rows(args.rows)), (Planets, planets_rows(args.rows))):
+        items = [model(**row).serialize() for row in rows]
+        with app.app_context():
+            body = app.json.response(items).get_data()
+            chunks = [app.json.dumps(items[start:start + STREAM_BATCH_SIZE], separators=(",", ":")).encode()
+                      for start in range(0, len(items), STREAM_BATCH_SIZE)]
+        print(f"{model.__tablename__:>8} {'identity':>8} {'-':>6} {'-':>7} {'-':>8} {'-':>8} {len(body):>10} {1:>6}")
+
+        for encoder_class in (Gzip, Brotli, Zstd):
+            for level in LEVELS[encoder_class.name]:
+                try:
+                    encoder = encoder_class(level)
+                except ImportError:
+                    break
+                runs = {"buffer": lambda: encoder.compress(body), "stream": lambda: b"".join(encoder.stream(chunks))}
+                for mode, run in runs.items():
+                    size = len(run())
+                    ms = timed(run)
+                    print(f"{model.__tablename__:>8} {encoder.name:>8} {level:>6} {mode:>7} {ms:>8.1f} "
+                          f"{len(body) / 1e3 / ms:>8.1f} {size:>10} {len(body) / size:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Latency of GET /users/<id>/favorites while the favorites table grows.
+
+    $ python benchmarks/bench_favorites.py 10000 100000 1000000
+
+Every user has 10 favorite planets, the lookup must stay flat no matter how many rows the table has.
+"""
+import random
+import sys
+
+from common import planets_rows, setup_app, timed, user_rows
+
+PLANETS = 1000
+PER_USER = 10
+
+
+def grow(app, db, users_from, users_to):
+    from models import FavoritePlanets, User
+    with app.app_context():
+        for start in range(users_from, users_to, 10000):
+            stop = min(start + 10000, users_to)
+            db.session.execute(User.__table__.insert(), user_rows(stop - start, start))
+            db.session.execute(FavoritePlanets.__table__.insert(), [
+                {"user_id": user_id, "planet_id": (user_id + j * 97) % PLANETS + 1}
+                for user_id in range(start, stop) for j in range(PER_USER)])
+        db.session.commit()
+
+
+def main(sizes):
+    app, db = setup_app()
+    from models import Planets
+    with app.app_context():
+        db.session.execute(Planets.__table__.insert(), planets_rows(PLANETS))
+        db.session.commit()
+    client = app.test_client()
+    rng = random.Random(7)
+
+    users = 1
+    print(f"{'favorites':>10} {'lookup ms':>10}")
+    for size in sorted(sizes):
+        grow(app, db, users, size // PER_USER + 1)
+        users = size // PER_USER + 1
+        latency = timed(lambda: client.get(f"/users/{rng.randint(1, users - 1)}/favorites"), repeat=50)
+        print(f"{size:>10} {latency:>10.2f}")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,40 @@
+"""
+Bytes on the wire and DB time of narrow (?fields=id,name) against full projections.
+
+    $ python benchmarks/bench_fields.py [rows]
+
+The DB time only covers cursor.execute, fetching the rows happens while the ORM loads them.
+"""
+import os
+import sys
+
+from common import QueryCounter, seed_people, seed_planets, setup_app, timed
+
+URLS = (
+    "/people",
+    "/people?fields=id,name",
+    "/planets",
+    "/planets?fields=id,name",
+    "/people?limit=100",
+    "/people?limit=100&fields=id,name",
+)
+
+
+def main(rows):
+    os.environ["CACHE_BACKEND"] = "none"
+    app, db = setup_app()
+    seed_people(app, db, rows)
+    seed_planets(app, db, rows)
+    client = app.test_client()
+
+    print(f"{'url':<36} {'bytes':>10} {'db ms':>8} {'total ms':>9}")
+    for url in URLS:
+        with app.app_context():
+            with QueryCounter(db.engine) as counter:
+                response = client.get(url)
+        total_ms = timed(lambda: client.get(url), repeat=3)
+        print(f"{url:<36} {len(response.data):>10} {counter.seconds * 1000:>8.2f} {total_ms:>9.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,42 @@
+"""
+Encoding throughput of the JSON providers (see src/json_provider.py) on serialized People and
+Planets lists, the body of GET /people and GET /planets.
+
+    $ python benchmarks/bench_json.py [--sizes 1000,10000,100000]
+
+Every size is also checked for byte-for-byte equal output between the providers.
+"""
+import argparse
+
+from common import people_rows, planets_rows, setup_app, timed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    args = parser.parse_args()
+
+    app, _ = setup_app()
+    from flask.json.provider import DefaultJSONProvider
+    from json_provider import OrjsonProvider
+    from models import People, Planets
+    providers = {"stdlib": DefaultJSONProvider(app), "orjson": OrjsonProvider(app)}
+
+    print(f"{'payload':>16} {'provider':>8} {'ms':>9} {'rows/s':>11} {'MB/s':>8}")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        for model, rows in ((People, people_rows(size)), (Planets, planets_rows(size))):
+            payload = [model(**row).serialize() for row in rows]
+            bodies = {}
+            with app.app_context():
+                for name, provider in providers.items():
+                    bodies[name] = provider.response(payload).get_data()
+                    ms = timed(lambda: provider.response(payload))
+                    seconds, megabytes = ms / 1000, len(bodies[name]) / 1e6
+                    print(f"{model.__tablename__ + ' x' + str(size):>16} {name:>8} {ms:>9.1f} "
+                          f"{size / seconds:>11.0f} {megabytes / seconds:>8.1f}")
+            if bodies["stdlib"] != bodies["orjson"]:
+                raise SystemExit(f"{model.__tablename__} x{size}: the providers disagree")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Compares /people full-table responses against keyset pages at different table sizes.
+
+    $ python benchmarks/bench_pagination.py 10000 100000 1000000
+
+Every scenario runs in a fresh interpreter so the peak RSS reported belongs to that scenario only.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from common import peak_rss_mb, seed_people, setup_app, timed
+
+PAGE_SIZE = 50
+
+
+def run_scenario(db_path, rows, mode):
+    # the repeated GETs would be answered by the response cache otherwise
+    os.environ["CACHE_BACKEND"] = "none"
+    app, _ = setup_app(db_path)
+    from utils import encode_cursor
+    client = app.test_client()
+    urls = {
+        "full": "/people",
+        "first_page": f"/people?limit={PAGE_SIZE}",
+        "deep_page": f"/people?limit={PAGE_SIZE}&after={encode_cursor(rows - PAGE_SIZE)}",
+    }
+    latency = timed(lambda: client.get(urls[mode]), repeat=1 if mode == "full" else 20)
+    print(json.dumps({"rows": rows, "mode": mode, "latency_ms": round(latency, 2),
+                      "peak_rss_mb": round(peak_rss_mb(), 1)}))
+
+
+def main(sizes):
+    print(f"{'rows':>10} {'mode':>12} {'latency ms':>12} {'peak rss MB':>12}")
+    for rows in sizes:
+        db_path = tempfile.mkstemp(suffix=".db")[1]
+        subprocess.check_call([sys.executable, __file__, "--seed", db_path, str(rows)])
+        for mode in ("full", "first_page", "deep_page"):
+            output = subprocess.check_output(
+                [sys.executable, __file__, "--scenario", db_path, str(rows), mode])
+            result = json.loads(output)
+            print(f"{result['rows']:>10} {result['mode']:>12} {result['latency_ms']:>12} {result['peak_rss_mb']:>12}")
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--seed":
+        seed_people(*setup_app(sys.argv[2]), int(sys.argv[3]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "--scenario":
+        run_scenario(sys.argv[2], int(sys.argv[3]), sys.argv[4])
+    else:
+        main([int(size) for size in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,391 @@
+"""
+Regression suite: every route of the API against a synthetic dataset (see dataset.py), compared
+with regression_baseline.json. Fails (exit code 1) when a route got slower than the threshold.
+
+    $ python benchmarks/bench_regression.py [--scale small] [--requests 200] [--duration 5]
+    $ python benchmarks/bench_regression.py --save              # record a new baseline
+    $ python benchmarks/bench_regression.py --skip-gunicorn --threshold 0.5
+
+Two passes over the same seeded SQLite file, with the response cache off so every request
+reaches the database:
+- gunicorn: the GET routes through a real gunicorn (WEB_CONCURRENCY=--workers) and the load
+  generator of loadgen.py with --concurrency clients, for --duration seconds each.
+  Records req/s, p50/p95/p99 and the peak RSS of the workers.
+- client: every route, writes included, --requests times through the Flask test client.
+  Records req/s, p50/p95/p99, the SQL statements per request and the peak Python memory
+  (tracemalloc) of one request. Write routes touch their own rows, set up before the timer starts.
+
+A route regresses when its req/s drops, or its p50 latency or peak memory grows, by more than
+--threshold (0.3), or when it issues more SQL statements than in the baseline. Latency changes
+under --noise-ms (0.5) never count. Both passes run every route in --rounds (5) rounds, one
+after the other, and keep the req/s and p50 of the best round: a burst of load from elsewhere on
+the machine slows a round, not the result. A machine that is slower all along is caught by a
+CPU-bound calibration (before, between and after the passes) the baseline timings are scaled by.
+p95 and p99 are over all the rounds, recorded but not checked, they move too much between two
+runs of the same code.
+A new route without a scenario below also fails.
+Baselines are only comparable on the same machine and dataset, record one before changing code.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from common import QueryCounter, people_rows, planets_rows, setup_app, user_rows
+from dataset import add_dataset_arguments, dataset_sizes, favorite_people, favorite_planet
+from loadgen import percentile, run_load, wait_until_up
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regression_baseline.json")
+BATCH = 100
+# rows created by the write scenarios get ids far above the dataset
+RESERVED = 10_000_000
+
+
+def without_id(row, **values):
+    return {**{key: value for key, value in row.items() if key != "id"}, **values}
+
+
+def insert(model, rows):
+    from models import db
+    db.session.execute(model.__table__.insert(), rows)
+    db.session.commit()
+
+
+def scenarios(sizes, requests):
+    """
+    (method, rule, make) for every route, make(i) returns the path and JSON body of the i-th
+    request and runs in the app context, so it can insert the rows a DELETE is going to remove
+    """
+    from jobs import enqueue
+    from models import FavoritePeople, FavoritePlanets, People, Planets
+    users, people, planets, favorites = sizes["users"], sizes["people"], sizes["planets"], sizes["favorites"]
+    span = requests + 1  # the timed requests and the traced one
+    # GET /jobs/<id> reads these, the gunicorn pass builds its paths outside of the app context
+    job_ids = [enqueue("warm_cache", {"paths": ["/people"]}).id for _ in range(span)]
+
+    def spread(i, count):
+        return i * 7919 % count + 1
+
+    def doomed_catalog(model, rows_of, base, i, count):
+        rows = [dict(row, name=f"Doomed {model.__tablename__} {row['id']}")
+                for row in rows_of(count, base + i * count)]
+        insert(model, rows)
+        return [row["id"] for row in rows]
+
+    # favorites j < favorites are in the dataset, every write scenario takes its own range of j
+    bulk_span = span * BATCH // users + 1
+    single_j, delete_j = favorites, favorites + span
+    bulk_j, bulk_delete_j = favorites + 2 * span, favorites + 2 * span + bulk_span
+
+    def bulk_favorites(column, favorite_of, count, i, first_j):
+        items = []
+        for k in range(BATCH):
+            n = i * BATCH + k
+            user_id = n % users + 1
+            items.append({"user_id": user_id, column: favorite_of(user_id, first_j + n // users, count)})
+        return items
+
+    def doomed_favorites(model, column, favorite_of, count, i):
+        rows = [dict(item, id=RESERVED + span + i * BATCH + k)
+                for k, item in enumerate(bulk_favorites(column, favorite_of, count, i, bulk_delete_j))]
+        insert(model, rows)
+        return [row["id"] for row in rows]
+
+    def doomed_favorite(model, column, favorite_of, count, i):
+        row = {"id": RESERVED + i, "user_id": 1, column: favorite_of(1, delete_j + i, count)}
+        insert(model, [row])
+        return row["id"]
+
+    return [
+        ("GET", "/", lambda i: ("/", None)),
+        ("GET", "/healthz", lambda i: ("/healthz", None)),
+        ("GET", "/readyz", lambda i: ("/readyz", None)),
+        ("GET", "/cache/stats", lambda i: ("/cache/stats", None)),
+        ("GET", "/jobs/<int:job_id>", lambda i: (f"/jobs/{job_ids[i % span]}", None)),
+        ("GET", "/jobs/stats", lambda i: ("/jobs/stats", None)),
+        ("GET", "/internal/pool", lambda i: ("/internal/pool", None)),
+
+        ("GET", "/user", lambda i: ("/user?limit=50" if i % 2 else "/user?limit=50&fields=id,email", None)),
+        ("GET", "/user/<int:user_id>", lambda i: (f"/user/{spread(i, users)}", None)),
+        ("GET", "/people", lambda i: (f"/people?limit=50&gender={'male' if i % 2 else 'female'}", None)),
+        ("GET", "/people/top", lambda i: ("/people/top" if i % 2 else "/people/top?limit=50&fields=id,name", None)),
+        ("GET", "/people/<int:people_id>", lambda i: (f"/people/{spread(i, people)}", None)),
+        ("GET", "/planets", lambda i: (f"/planets?limit=50&sort=-population&population__lt={spread(i, planets) * 1000}", None)),
+        ("GET", "/planets/top", lambda i: ("/planets/top" if i % 2 else "/planets/top?limit=50&fields=id,name", None)),
+        ("GET", "/planets/<int:planet_id>", lambda i: (f"/planets/{spread(i, planets)}", None)),
+        ("GET", "/users/favorites", lambda i: ("/users/favorites", None)),
+        ("GET", "/users/<int:user_id>/favorites", lambda i: (f"/users/{spread(i, users)}/favorites", None)),
+
+        ("POST", "/cache/warm", lambda i: ("/cache/warm", {"paths": [f"/people/{spread(i, people)}"]})),
+
+        ("POST", "/user", lambda i: ("/user", without_id(user_rows(1, 2 * RESERVED + i)[0]))),
+        ("PATCH", "/user/<int:user_id>", lambda i: (f"/user/{spread(i, users)}", {"first_name": f"Renamed{i}"})),
+        # only queues the delete_user job, no worker runs during the benchmark
+        ("DELETE", "/user/<int:user_id>", lambda i: (f"/user/{spread(i, users)}", None)),
+
+        ("POST", "/people", lambda i: ("/people", without_id(people_rows(1)[0], name=f"New person {i}"))),
+        ("PUT", "/people", lambda i: ("/people", without_id(people_rows(1, spread(i, people))[0], mass=i % 200))),
+        ("PATCH", "/people/<int:people_id>", lambda i: (f"/people/{spread(i, people)}", {"height": 100 + i % 100})),
+        ("POST", "/people/bulk", lambda i: ("/people/bulk", [
+            without_id(row, name=f"Bulk person {row['id']}") for row in people_rows(BATCH, i * BATCH)])),
+        ("PATCH", "/people/bulk", lambda i: ("/people/bulk", [
+            {"id": (i * BATCH + k) % people + 1, "mass": i % 200} for k in range(BATCH)])),
+        ("DELETE", "/people/<int:people_id>", lambda i: (f"/people/{doomed_catalog(People, people_rows, RESERVED, i, 1)[0]}", None)),
+        ("DELETE", "/people/bulk", lambda i: ("/people/bulk", doomed_catalog(People, people_rows, 2 * RESERVED, i, BATCH))),
+        ("POST", "/people/import", lambda i: ("/people/import", [
+            without_id(row, name=f"Imported person {row['id']}") for row in people_rows(BATCH, i * BATCH)])),
+
+        ("POST", "/planets", lambda i: ("/planets", without_id(planets_rows(1)[0], name=f"New planet {i}"))),
+        ("PUT", "/planets", lambda i: ("/planets", without_id(planets_rows(1, spread(i, planets))[0], gravity=f"{i % 3} standard"))),
+        ("PATCH", "/planets/<int:planet_id>", lambda i: (f"/planets/{spread(i, planets)}", {"diameter": 1000 + i})),
+        ("POST", "/planets/bulk", lambda i: ("/planets/bulk", [
+            without_id(row, name=f"Bulk planet {row['id']}") for row in planets_rows(BATCH, i * BATCH)])),
+        ("PATCH", "/planets/bulk", lambda i: ("/planets/bulk", [
+            {"id": (i * BATCH + k) % planets + 1, "population": i} for k in range(BATCH)])),
+        ("DELETE", "/planets/<int:planet_id>", lambda i: (f"/planets/{doomed_catalog(Planets, planets_rows, RESERVED, i, 1)[0]}", None)),
+        ("DELETE", "/planets/bulk", lambda i: ("/planets/bulk", doomed_catalog(Planets, planets_rows, 2 * RESERVED, i, BATCH))),
+        ("POST", "/planets/import", lambda i: ("/planets/import", [
+            without_id(row, name=f"Imported planet {row['id']}") for row in planets_rows(BATCH, i * BATCH)])),
+
+        ("POST", "/favorite/planet/<int:planet_id>", lambda i: (
+            f"/favorite/planet/{favorite_planet(i % users + 1, single_j + i // users, planets)}", {"user_id": i % users + 1})),
+        ("POST", "/favorite/people/<int:people_id>", lambda i: (
+            f"/favorite/people/{favorite_people(i % users + 1, single_j + i // users, people)}", {"user_id": i % users + 1})),
+        ("POST", "/favorite/planet/bulk", lambda i: ("/favorite/planet/bulk", bulk_favorites("planet_id", favorite_planet, planets, i, bulk_j))),
+        ("POST", "/favorite/people/bulk", lambda i: ("/favorite/people/bulk", bulk_favorites("people_id", favorite_people, people, i, bulk_j))),
+        ("DELETE", "/favorite/planet/<int:planet_id>", lambda i: (
+            f"/favorite/planet/{doomed_favorite(FavoritePlanets, 'planet_id', favorite_planet, planets, i)}", None)),
+        ("DELETE", "/favorite/people/<int:people_id>", lambda i: (
+            f"/favorite/people/{doomed_favorite(FavoritePeople, 'people_id', favorite_people, people, i)}", None)),
+        ("DELETE", "/favorite/planet/bulk", lambda i: (
+            "/favorite/planet/bulk", doomed_favorites(FavoritePlanets, "planet_id", favorite_planet, planets, i))),
+        ("DELETE", "/favorite/people/bulk", lambda i: (
+            "/favorite/people/bulk", doomed_favorites(FavoritePeople, "people_id", favorite_people, people, i))),
+    ]
+
+
+def calibrate(repeat=15):
+    # a fixed CPU-bound workload, the baseline timings are scaled by how fast it ran on both sides
+    rows = people_rows(2000)
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        json.dumps(rows, sort_keys=True)
+        samples.append((time.perf_counter() - started) * 1000)
+    return min(samples)
+
+
+def api_routes(app):
+    return {(method, rule.rule) for rule in app.url_map.iter_rules() if rule.endpoint.startswith("api.")
+            for method in rule.methods - {"HEAD", "OPTIONS"}}
+
+
+def summary(rounds):
+    # best round for req/s and p50, the tail over every request
+    latencies = [latency for samples in rounds for latency in samples]
+    best = min(rounds, key=lambda samples: percentile(samples, 50))
+    return {
+        "rps": round(len(best) / (sum(best) / 1000), 1),
+        "p50_ms": round(percentile(best, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+def run_client(app, db, routes, requests, rounds):
+    client = app.test_client()
+    latencies = {(method, rule): [[] for _ in range(rounds)] for method, rule, _ in routes}
+    queries = {(method, rule): 0 for method, rule, _ in routes}
+    peaks = {}
+
+    def send(method, rule, make, i):
+        with app.app_context():
+            path, body = make(i)
+        with app.app_context(), QueryCounter(db.engine) as counter:
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code >= 300:
+            raise SystemExit(f"{method} {path}: {response.status_code} {response.get_data(as_text=True)[:200]}")
+        queries[method, rule] = max(queries[method, rule], counter.count)
+        return elapsed
+
+    # request i of every route runs in round i % rounds, so every round uses its own rows
+    for round_index in range(rounds):
+        for method, rule, make in routes:
+            for i in range(round_index, requests, rounds):
+                latencies[method, rule][round_index].append(send(method, rule, make, i))
+    for method, rule, make in routes:
+        # one more request, traced, for the memory it needs at its peak
+        tracemalloc.start()
+        send(method, rule, make, requests)
+        peaks[method, rule] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {f"{method} {rule}": dict(summary(latencies[method, rule]), queries=queries[method, rule],
+                                     peak_kb=round(peaks[method, rule] / 1024))
+            for method, rule, _ in routes}
+
+
+def worker_peak_rss_mb(pid):
+    # VmHWM of the gunicorn workers (children of the master), Linux only
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as children_file:
+            children = children_file.read().split()
+        peaks = []
+        for child in children:
+            with open(f"/proc/{child}/status") as status_file:
+                for line in status_file:
+                    if line.startswith("VmHWM:"):
+                        peaks.append(int(line.split()[1]) / 1024)
+        return round(max(peaks), 1) if peaks else None
+    except OSError:
+        return None
+
+
+def run_gunicorn(db_path, routes, args):
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + db_path, CACHE_BACKEND="none", PORT=str(args.port),
+               WEB_CONCURRENCY=str(args.workers), DB_POOL_SIZE=str(args.concurrency))
+    server = subprocess.Popen(["gunicorn", "wsgi", "--chdir", "./src/", "--log-level", "warning"], cwd=ROOT, env=env)
+    results = {}
+    try:
+        wait_until_up(base_url)
+        reads = [(method, rule, [make(i)[0] for i in range(args.requests)]) for method, rule, make in routes
+                 if method == "GET"]
+        rounds = {(method, rule): [] for method, rule, _ in reads}
+        for _ in range(args.rounds):
+            for method, rule, paths in reads:
+                result = run_load(base_url, paths, args.concurrency, args.duration / args.rounds)
+                if result["errors"]:
+                    raise SystemExit(f"{method} {rule}: {result['errors']} errors under load")
+                rounds[method, rule].append(result)
+        for (method, rule), results_of_rounds in rounds.items():
+            best = max(results_of_rounds, key=lambda result: result["rps"])
+            results[f"{method} {rule}"] = {
+                "rps": best["rps"],
+                "p50_ms": min(result["p50_ms"] for result in results_of_rounds),
+                "p95_ms": max(result["p95_ms"] for result in results_of_rounds),
+                "p99_ms": max(result["p99_ms"] for result in results_of_rounds),
+            }
+        results["workers"] = {"peak_rss_mb": worker_peak_rss_mb(server.pid)}
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+def regressions(report, baseline, threshold, noise_ms):
+    def grew(now, was, noise=0.0):
+        return now is not None and was is not None and now > was * (1 + threshold) and now - was > noise
+
+    speed = report["calibration_ms"] / baseline["calibration_ms"]
+
+    def slower(now, was):
+        return grew(now, was * speed, noise_ms)
+
+    found = []
+    for run, routes in report["runs"].items():
+        for route, metrics in routes.items():
+            before = baseline["runs"].get(run, {}).get(route)
+            if before is None:
+                continue
+            # req/s compared as the time per request, so the noise margin applies to it too
+            if "rps" in metrics and slower(1000 / metrics["rps"], 1000 / before["rps"]):
+                found.append(f"{run} {route}: {metrics['rps']} req/s, was {before['rps']}")
+            if "p50_ms" in metrics and slower(metrics["p50_ms"], before["p50_ms"]):
+                found.append(f"{run} {route}: p50 {metrics['p50_ms']} ms, was {before['p50_ms']}")
+            for key in ("peak_kb", "peak_rss_mb"):
+                if grew(metrics.get(key), before.get(key)):
+                    found.append(f"{run} {route}: {key} {metrics[key]}, was {before[key]}")
+            if "queries" in before and metrics["queries"] > before["queries"]:
+                found.append(f"{run} {route}: {metrics['queries']} SQL statements, was {before['queries']}")
+    return found
+
+
+def print_run(name, results, baseline):
+    print(f"\n{name}")
+    print(f"{'route':<38} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'peak':>8} {'base req/s':>11}")
+    for route, metrics in results.items():
+        before = baseline.get(route, {})
+        peak = metrics.get("peak_kb", metrics.get("peak_rss_mb", ""))
+        print(f"{route:<38} {metrics.get('rps', ''):>9} {metrics.get('p50_ms', ''):>8} {metrics.get('p95_ms', ''):>8} "
+              f"{metrics.get('p99_ms', ''):>8} {metrics.get('queries', ''):>8} {str(peak):>8} {before.get('rps', '-'):>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_dataset_arguments(parser)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route through the test client")
+    parser.add_argument("--duration", type=float, default=5, help="seconds of load per GET route through gunicorn")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--threshold", type=float, default=0.3)
+    parser.add_argument("--noise-ms", type=float, default=0.5)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--skip-gunicorn", action="store_true")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args()
+
+    sizes = dataset_sizes(args)
+    span = args.requests + 1
+    if sizes["favorites"] + 2 * span + 2 * (span * BATCH // sizes["users"] + 1) >= \
+            min(sizes["people"], sizes["planets"]):
+        parser.error("too many --requests for the size of the people and planets tables")
+
+    # every run starts from a fresh copy of the dataset, the client run writes to it
+    os.environ["CACHE_BACKEND"] = "none"
+    db_path = tempfile.mkstemp(suffix=".db")[1]
+    subprocess.run([sys.executable, "dataset.py", db_path, "--scale", args.scale] +
+                   [f"--{name}={count}" for name, count in sizes.items()],
+                   cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    app, db = setup_app(db_path)
+    with app.app_context():
+        routes = scenarios(sizes, args.requests)
+    missing = api_routes(app) - {(method, rule) for method, rule, _ in routes}
+    if missing:
+        raise SystemExit("routes without a scenario: " + ", ".join(f"{method} {rule}" for method, rule in sorted(missing)))
+
+    report = {"dataset": sizes, "requests": args.requests, "runs": {}}
+    calibration = [calibrate()]
+    if not args.skip_gunicorn:
+        report["runs"]["gunicorn"] = run_gunicorn(db_path, routes, args)
+    calibration.append(calibrate())
+    report["runs"]["client"] = run_client(app, db, routes, args.requests, args.rounds)
+    calibration.append(calibrate())
+    report["calibration_ms"] = round(sorted(calibration)[1], 3)
+
+    baseline = {"dataset": None, "runs": {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    comparable = baseline["dataset"] == sizes and baseline.get("requests") == args.requests
+    for name, results in report["runs"].items():
+        print_run(name, results, baseline["runs"].get(name, {}) if comparable else {})
+
+    if args.save:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+            baseline_file.write("\n")
+        print(f"\nbaseline written to {os.path.relpath(args.baseline, ROOT)}")
+        return
+    if not comparable:
+        print("\nno baseline for this dataset and --requests, record one with --save")
+        return
+    found = regressions(report, baseline, args.threshold, args.noise_ms)
+    for line in found:
+        print("REGRESSION " + line)
+    if found:
+        sys.exit(1)
+    print(f"\nno regression over {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Cold start of the API: what importing it costs (`python -X importtime`) and how long a fresh
+gunicorn worker takes to answer its first request.
+
+    $ python benchmarks/bench_startup.py [--runs 5]     # compare with importtime_baseline.json
+    $ python benchmarks/bench_startup.py --save         # record a new baseline
+
+The import report lists the third-party modules pulled in by the modules of src/ with their
+cumulative import time, so a new heavy import shows up next to the one that brought it in.
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SRC_DIR = os.path.join(ROOT, "src")
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "importtime_baseline.json")
+LOCAL_MODULES = {name[:-3] for name in os.listdir(SRC_DIR) if name.endswith(".py")}
+
+
+def parse_importtime(output):
+    # -X importtime prints a module after everything it imported, one indent level deeper per parent
+    pending = {}
+    total_us, imports = 0, {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, raw_name = line.split("|")
+        name = raw_name.strip()
+        depth = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+        children = pending.pop(depth + 1, [])
+        if name in LOCAL_MODULES:
+            for child, child_us in children:
+                if child.split(".")[0] not in LOCAL_MODULES:
+                    imports[child] = imports.get(child, 0) + child_us
+        if name == "wsgi":
+            total_us = int(cumulative)
+        pending.setdefault(depth, []).append((name, int(cumulative)))
+    return total_us, imports
+
+
+def measure_imports(env, runs):
+    totals, imports = [], {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import wsgi"],
+                                cwd=SRC_DIR, env=env, capture_output=True, text=True, check=True)
+        total_us, run_imports = parse_importtime(result.stderr)
+        totals.append(total_us)
+        for name, us in run_imports.items():
+            imports.setdefault(name, []).append(us)
+    return {
+        "total_ms": round(statistics.median(totals) / 1000, 1),
+        "imports": {name: round(statistics.median(samples) / 1000, 1) for name, samples in imports.items()},
+    }
+
+
+def get(port, path):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+    connection.request("GET", path)
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def measure_first_request(env, port, timeout=30):
+    started = time.perf_counter()
+    server = subprocess.Popen(["gunicorn", "wsgi", "--chdir", "./src/", "--log-level", "warning"],
+                              cwd=ROOT, env=dict(env, PORT=str(port), WEB_CONCURRENCY="1"))
+    try:
+        while True:
+            try:
+                get(port, "/healthz")
+                break
+            except OSError:
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError(f"gunicorn did not answer in {timeout} seconds")
+                time.sleep(0.005)
+        first_request = time.perf_counter() - started
+        # the first query also opens the engine and its first connection
+        get(port, "/people?limit=1")
+        first_query = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+    return first_request * 1000, first_query * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--save", action="store_true", help="write the import times as the new baseline")
+    args = parser.parse_args()
+
+    db_path = tempfile.mkstemp(suffix=".db")[1]
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + db_path)
+    subprocess.run([sys.executable, "-c", "from app import create_app; from models import db; "
+                    "app = create_app(); app.app_context().push(); db.create_all()"], cwd=SRC_DIR, env=env, check=True)
+
+    report = measure_imports(env, args.runs)
+    baseline = {"total_ms": 0, "imports": {}}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print(f"{'import':<32} {'ms':>8} {'baseline':>9}")
+    for name, ms in sorted(report["imports"].items(), key=lambda item: -item[1]):
+        print(f"{name:<32} {ms:>8} {baseline['imports'].get(name, 'new'):>9}")
+    for name in sorted(set(baseline["imports"]) - set(report["imports"])):
+        print(f"{name:<32} {'gone':>8} {baseline['imports'][name]:>9}")
+    print(f"{'import wsgi (total)':<32} {report['total_ms']:>8} {baseline['total_ms']:>9}")
+
+    samples = [measure_first_request(env, args.port) for _ in range(args.runs)]
+    print(f"time to first request: {statistics.median(s[0] for s in samples):.0f} ms (median of {args.runs})")
+    print(f"time to first query:   {statistics.median(s[1] for s in samples):.0f} ms")
+
+    if args.save:
+        with open(BASELINE, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"baseline written to {os.path.relpath(BASELINE, ROOT)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Requests/sec and tail latency of the gunicorn worker modes (see gunicorn.conf.py) under
+50 to 500 concurrent clients, against a seeded local SQLite database.
+
+    $ python benchmarks/bench_workers.py [--duration 10] [--workers 2] [--modes sync,gthread,gevent]
+
+Set DATABASE_URL to a local Postgres to benchmark against it instead (it must be migrated already).
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from common import seed_people, seed_planets, setup_app
+from loadgen import run_load, wait_until_up
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CONCURRENCY = (50, 100, 250, 500)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--modes", default="sync,gthread,gevent")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL")
+    if database_url is None:
+        db_path = tempfile.mkstemp(suffix=".db")[1]
+        subprocess.check_call([sys.executable, __file__, "--seed", db_path])
+        database_url = "sqlite:///" + db_path
+
+    rng = random.Random(1)
+    paths = [f"/people/{rng.randint(1, 5000)}" for _ in range(200)] + \
+            ["/planets?limit=20"] * 20 + ["/users/1/favorites"] * 20
+    rng.shuffle(paths)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    print(f"{'mode':>8} {'clients':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in args.modes.split(","):
+        env = dict(os.environ, DATABASE_URL=database_url, WORKER_MODE=mode, CACHE_BACKEND="none",
+                   WEB_CONCURRENCY=str(args.workers), PORT=str(args.port), DB_POOL_SIZE="20")
+        server = subprocess.Popen(["gunicorn", "wsgi", "--chdir", "./src/", "--log-level", "warning"],
+                                  cwd=ROOT, env=env)
+        try:
+            wait_until_up(base_url)
+            for clients in CONCURRENCY:
+                result = run_load(base_url, paths, clients, args.duration)
+                print(f"{mode:>8} {clients:>8} {result['rps']:>8} {result['p50_ms']:>8} "
+                      f"{result['p95_ms']:>8} {result['p99_ms']:>8} {result['errors']:>7}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--seed":
+        app, db = setup_app(sys.argv[2])
+        seed_people(app, db, 5000)
+        seed_planets(app, db, 500)
+    else:
+        main()
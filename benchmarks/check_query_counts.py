@@ -0,0 +1,71 @@
+"""
+Fails (exit code 1) when the number of SQL statements of a read endpoint grows with the result size.
+
+    $ python benchmarks/check_query_counts.py
+
+The same requests run against a database with 1, 10 and 50 favorites per table, every endpoint
+must issue exactly the same number of queries at every size.
+"""
+import os
+import sys
+
+from common import QueryCounter, seed_people, seed_planets, seed_users, setup_app
+
+SIZES = (1, 10, 50)
+ENDPOINTS = (
+    "/user",
+    "/user?limit=20",
+    "/user/1",
+    "/user/1?include=favorites_people",
+    "/user/1?include=",
+    "/people",
+    "/people?limit=20",
+    "/people/1",
+    "/planets",
+    "/planets?limit=20",
+    "/planets/1",
+    "/users/favorites",
+)
+
+
+def reset(app, db, size):
+    from models import FavoritePeople, FavoritePlanets
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    seed_users(app, db, size)
+    seed_people(app, db, size)
+    seed_planets(app, db, size)
+    with app.app_context():
+        db.session.execute(FavoritePlanets.__table__.insert(),
+                           [{"user_id": 1, "planet_id": i} for i in range(1, size + 1)])
+        db.session.execute(FavoritePeople.__table__.insert(),
+                           [{"user_id": 1, "people_id": i} for i in range(1, size + 1)])
+        db.session.commit()
+
+
+def main():
+    # cache hits would hide the queries of the endpoints
+    os.environ["CACHE_BACKEND"] = "none"
+    app, db = setup_app()
+    client = app.test_client()
+    counts = {endpoint: {} for endpoint in ENDPOINTS}
+    for size in SIZES:
+        reset(app, db, size)
+        for endpoint in ENDPOINTS:
+            with app.app_context():
+                with QueryCounter(db.engine) as counter:
+                    response = client.get(endpoint)
+            assert response.status_code == 200, (endpoint, response.status_code)
+            counts[endpoint][size] = counter.count
+
+    failed = False
+    for endpoint, by_size in counts.items():
+        status = "ok" if len(set(by_size.values())) == 1 else "GROWS"
+        failed = failed or status != "ok"
+        print(f"{endpoint:<22} {by_size} {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
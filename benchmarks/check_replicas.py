@@ -0,0 +1,95 @@
+"""
+Fails (exit code 1) when the read replica routing of src/replicas.py breaks.
+
+    $ python benchmarks/check_replicas.py
+
+Two SQLite files stand in for the primary and a replica that fell behind: the replica is a copy
+taken before the primary was changed. Checks that the GET endpoints read the replica in round
+robin, writes go to the primary, the writing client reads its own writes and that reads fall back
+to the primary when no replica answers.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+from common import seed_people, seed_planets, seed_users, setup_app
+
+
+def copy_database(source, target):
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+
+
+def rename(path, people_id, name, table="people"):
+    with sqlite3.connect(path) as connection:
+        connection.execute(f"UPDATE {table} SET name = ? WHERE id = ?", (name, people_id))
+
+
+def name_of(client, people_id=1):
+    response = client.get(f"/people/{people_id}")
+    assert response.status_code == 200, response.status_code
+    return response.get_json()["name"]
+
+
+def main():
+    os.environ["CACHE_BACKEND"] = "none"
+    primary = tempfile.mkstemp(suffix=".db")[1]
+    replicas = [tempfile.mkstemp(suffix=".db")[1] for _ in range(2)]
+    failures = []
+
+    def check(label, ok):
+        print(f"{'ok' if ok else 'FAIL':>4}  {label}")
+        if not ok:
+            failures.append(label)
+
+    os.environ["DATABASE_REPLICA_URLS"] = ",".join("sqlite:///" + path for path in replicas)
+    app, db = setup_app(primary)
+    seed_people(app, db, 3)
+    seed_users(app, db, 1)
+    seed_planets(app, db, 1)
+    with app.app_context():
+        from models import FavoritePlanets
+        db.session.execute(FavoritePlanets.__table__.insert(), [{"user_id": 1, "planet_id": 1}])
+        db.session.commit()
+    for index, path in enumerate(replicas):
+        copy_database(primary, path)
+        rename(path, 1, f"replica {index}")
+        rename(path, 1, "replica planet", "planets")
+    rename(primary, 1, "primary")
+    rename(primary, 1, "primary planet", "planets")
+
+    reader = app.test_client()
+    names = [name_of(reader) for _ in range(4)]
+    check("GETs alternate between the replicas", names == ["replica 0", "replica 1"] * 2)
+    # the favorites of /user/<id> come from a UNION ALL, it has to go to the replica as well
+    embedded = reader.get("/user/1").get_json()["favorites_planets"][0]["planet"]
+    listed = reader.get("/users/1/favorites").get_json()["planets"][0]["planet"]
+    check("/user/<id> and /users/<id>/favorites read the same replica data",
+          embedded == listed == "replica planet")
+
+    writer = app.test_client()
+    response = writer.patch("/people/2", json={"name": "written"})
+    check("writes go to the primary", response.status_code == 200 and name_of(writer, 2) == "written")
+    check("the writer reads the primary", name_of(writer) == "primary")
+    check("other clients still read the replicas", name_of(reader).startswith("replica"))
+
+    writer.delete_cookie("read_primary_until")
+    check("the writer reads the replicas after the window", name_of(writer).startswith("replica"))
+
+    # the replicas go away: their files can't be opened any more and the next health check notices
+    router = app.extensions["replicas"]
+    for key, path in zip(sorted(router.engines), replicas):
+        router.engines[key].dispose()
+        os.remove(path)
+        os.mkdir(path)
+        router.next_check[key] = 0
+    check("reads fall back to the primary when no replica is up", name_of(reader) == "primary")
+    check("the replicas are marked unhealthy", set(router.stats().values()) == {"unhealthy"})
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Shared helpers for the benchmark scripts, every benchmark runs the API against a throwaway SQLite file
+"""
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def setup_app(db_path=None):
+    # DATABASE_URL has to be set before create_app(), it is read when the app is configured
+    if db_path is None:
+        db_path = tempfile.mkstemp(suffix=".db")[1]
+    os.environ["DATABASE_URL"] = "sqlite:///" + db_path
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    from app import create_app
+    app = create_app()
+    from models import db
+    with app.app_context():
+        db.create_all()
+    return app, db
+
+
+def people_rows(count, start=1):
+    return [{
+        "id": i,
+        "name": f"Person {i}",
+        "gender": "male" if i % 2 else "female",
+        "height": 150 + i % 60,
+        "mass": 50 + i % 70,
+        "hair_color": "brown",
+        "skin_color": "fair",
+        "eye_color": "blue",
+        "birth_year": f"{i % 900}BBY"
+    } for i in range(start, start + count)]
+
+
+def planets_rows(count, start=1):
+    return [{
+        "id": i,
+        "name": f"Planet {i}",
+        "diameter": 5000 + i % 10000,
+        "rotation_period": 10 + i % 30,
+        "orbital_period": 200 + i % 500,
+        "gravity": "1 standard",
+        "population": i * 1000,
+        "climate": ("arid", "temperate", "frozen", "murky")[i % 4],
+        "terrain": ("desert", "grasslands", "tundra", "swamp")[i % 4],
+        "surface_water": i % 100
+    } for i in range(start, start + count)]
+
+
+def user_rows(count, start=1):
+    return [{
+        "id": i,
+        "first_name": f"First{i}",
+        "last_name": f"Last{i}",
+        "email": f"user{i}@example.com",
+        "password": "secret",
+        "is_active": True
+    } for i in range(start, start + count)]
+
+
+def seed_planets(app, db, count, chunk=20000):
+    from models import Planets
+    with app.app_context():
+        for start in range(1, count + 1, chunk):
+            db.session.execute(Planets.__table__.insert(), planets_rows(min(chunk, count - start + 1), start))
+        db.session.commit()
+
+
+def seed_users(app, db, count, chunk=20000):
+    from models import User
+    with app.app_context():
+        for start in range(1, count + 1, chunk):
+            db.session.execute(User.__table__.insert(), user_rows(min(chunk, count - start + 1), start))
+        db.session.commit()
+
+
+class QueryCounter:
+    """Counts the SQL statements sent to the engine while the block runs, and the time they took"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self.seconds = 0.0
+        self._started = None
+
+    def _before(self, *args):
+        self._started = time.perf_counter()
+
+    def _after(self, *args):
+        self.count += 1
+        self.seconds += time.perf_counter() - self._started
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, "before_cursor_execute", self._before)
+        event.listen(self.engine, "after_cursor_execute", self._after)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, "before_cursor_execute", self._before)
+        event.remove(self.engine, "after_cursor_execute", self._after)
+
+
+def seed_people(app, db, count, chunk=20000):
+    from models import People
+    with app.app_context():
+        for start in range(1, count + 1, chunk):
+            db.session.execute(People.__table__.insert(), people_rows(min(chunk, count - start + 1), start))
+        db.session.commit()
+
+
+def timed(fn, repeat=5):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
@@ -0,0 +1,82 @@
+"""
+Synthetic dataset for the benchmarks: users, people, planets and the favorites of every user.
+
+    $ python benchmarks/dataset.py /tmp/bench.db [--scale medium] [--users 50000] [--favorites 20]
+
+The rows are the same for the same sizes, so two runs of a benchmark read the same data.
+User u favorites the planets (u + j * 97) % planets + 1 and the people (u + j * 89) % people + 1
+for j < favorites, distinct as long as favorites is smaller than both tables.
+"""
+import argparse
+
+from common import seed_people, seed_planets, seed_users, setup_app
+
+SCALES = {
+    "small": {"users": 1000, "people": 1000, "planets": 500, "favorites": 5},
+    "medium": {"users": 10000, "people": 10000, "planets": 5000, "favorites": 10},
+    "large": {"users": 100000, "people": 100000, "planets": 50000, "favorites": 10},
+}
+PLANET_STEP, PEOPLE_STEP = 97, 89
+
+
+def favorite_planet(user_id, j, planets):
+    return (user_id + j * PLANET_STEP) % planets + 1
+
+
+def favorite_people(user_id, j, people):
+    return (user_id + j * PEOPLE_STEP) % people + 1
+
+
+def seed_favorites(app, db, users, people, planets, favorites, chunk=2000):
+    from models import FavoritePeople, FavoritePlanets
+    with app.app_context():
+        for start in range(1, users + 1, chunk):
+            user_ids = range(start, min(start + chunk, users + 1))
+            db.session.execute(FavoritePlanets.__table__.insert(), [
+                {"user_id": user_id, "planet_id": favorite_planet(user_id, j, planets)}
+                for user_id in user_ids for j in range(favorites)])
+            db.session.execute(FavoritePeople.__table__.insert(), [
+                {"user_id": user_id, "people_id": favorite_people(user_id, j, people)}
+                for user_id in user_ids for j in range(favorites)])
+        db.session.commit()
+
+
+def seed_dataset(app, db, users, people, planets, favorites):
+    from models import reconcile_favorite_counts
+    seed_users(app, db, users)
+    seed_people(app, db, people)
+    seed_planets(app, db, planets)
+    seed_favorites(app, db, users, people, planets, favorites)
+    with app.app_context():
+        # the favorites went in with plain INSERTs, the counters are set from them afterwards
+        reconcile_favorite_counts()
+
+
+def dataset_sizes(args):
+    # a named scale, every size can be overridden on its own
+    sizes = dict(SCALES[args.scale])
+    for name in sizes:
+        if getattr(args, name, None) is not None:
+            sizes[name] = getattr(args, name)
+    return sizes
+
+
+def add_dataset_arguments(parser):
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    for name in SCALES["small"]:
+        parser.add_argument(f"--{name}", type=int)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db_path")
+    add_dataset_arguments(parser)
+    args = parser.parse_args()
+    sizes = dataset_sizes(args)
+    app, db = setup_app(args.db_path)
+    seed_dataset(app, db, **sizes)
+    print(f"seeded {args.db_path}: " + ", ".join(f"{count} {name}" for name, count in sizes.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Load test of the catalog endpoints with and without the response cache.
+
+    $ python benchmarks/load_cache.py [rows] [requests]
+
+Each backend runs in a fresh interpreter against the same seeded database and reports p50/p99 latency.
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import seed_people, seed_planets, setup_app
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def run_scenario(db_path, rows, requests):
+    app, _ = setup_app(db_path)
+    from cache import cache
+    client = app.test_client()
+    rng = random.Random(42)
+    # read-heavy reference data: a few hot items and list pages
+    urls = ["/people", "/planets", "/people?limit=50", "/planets?limit=50"] + \
+           [f"/people/{rng.randint(1, rows)}" for _ in range(50)] + \
+           [f"/planets/{rng.randint(1, rows)}" for _ in range(50)]
+    samples = []
+    for _ in range(requests):
+        url = rng.choice(urls)
+        started = time.perf_counter()
+        client.get(url)
+        samples.append((time.perf_counter() - started) * 1000)
+    print(json.dumps({**cache.stats(), "backend": os.environ["CACHE_BACKEND"], "p50_ms": round(percentile(samples, 50), 3),
+                      "p99_ms": round(percentile(samples, 99), 3)}))
+
+
+def main(rows, requests):
+    db_path = tempfile.mkstemp(suffix=".db")[1]
+    subprocess.check_call([sys.executable, __file__, "--seed", db_path, str(rows)])
+    print(f"{'backend':>8} {'p50 ms':>10} {'p99 ms':>10} {'hits':>8} {'misses':>8}")
+    for backend in ("none", "memory"):
+        output = subprocess.check_output([sys.executable, __file__, "--scenario", db_path, str(rows), str(requests)],
+                                         env=dict(os.environ, CACHE_BACKEND=backend))
+        result = json.loads(output)
+        print(f"{result['backend']:>8} {result['p50_ms']:>10} {result['p99_ms']:>10} {result['hits']:>8} {result['misses']:>8}")
+    os.remove(db_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--seed":
+        app, db = setup_app(sys.argv[2])
+        seed_people(app, db, int(sys.argv[3]))
+        seed_planets(app, db, int(sys.argv[3]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "--scenario":
+        run_scenario(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000, int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
@@ -0,0 +1,59 @@
+"""
+Gunicorn settings, loaded automatically by `gunicorn wsgi --chdir ./src/` (Procfile and render.yaml).
+
+WORKER_MODE picks how the workers wait on the database:
+- sync (default): one request per worker, the worker is blocked during every query
+- gthread: WORKER_THREADS requests per worker, each thread gets its own SQLAlchemy session
+- gevent: WORKER_CONNECTIONS requests per worker on greenlets, the DB driver is patched to yield
+  while it waits (psycopg2 needs `pipenv install gevent psycogreen`)
+
+The URLs and responses are the same in every mode. Flask-SQLAlchemy scopes the session to the
+app context, so every thread/greenlet already works with its own session. Keep
+DB_POOL_SIZE + DB_MAX_OVERFLOW close to the number of concurrent requests per worker.
+"""
+import glob
+import os
+
+worker_mode = os.getenv("WORKER_MODE", "sync")
+
+bind = "0.0.0.0:" + os.getenv("PORT", "8000")
+# gunicorn's default is 1 worker. Not derived from cpu_count(): in a container it sees the host's CPUs,
+# and every worker adds its memory and DB_POOL_SIZE + DB_MAX_OVERFLOW database connections
+if os.getenv("WEB_CONCURRENCY"):
+    workers = int(os.environ["WEB_CONCURRENCY"])
+timeout = int(os.getenv("WORKER_TIMEOUT", 30))
+
+if worker_mode == "gthread":
+    worker_class = "gthread"
+    threads = int(os.getenv("WORKER_THREADS", 8))
+elif worker_mode == "gevent":
+    worker_class = "gevent"
+    worker_connections = int(os.getenv("WORKER_CONNECTIONS", 200))
+elif worker_mode != "sync":
+    raise ValueError(f"Unknown WORKER_MODE {worker_mode}, use sync, gthread or gevent")
+
+
+def post_fork(server, worker):
+    if worker_mode != "gevent" or not os.getenv("DATABASE_URL", "").startswith("postgres"):
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        server.log.warning("psycogreen is not installed, Postgres queries will block the gevent workers")
+    else:
+        patch_psycopg()
+
+
+def on_starting(server):
+    # samples left by a previous run would be added to the new ones
+    multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
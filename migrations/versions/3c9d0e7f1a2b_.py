@@ -0,0 +1,65 @@
+"""per user unique favorites and user_id indexes
+
+Revision ID: 3c9d0e7f1a2b
+Revises: 8f2b1c3d4e5a
+Create Date: 2026-10-18 10:02:17.550911
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9d0e7f1a2b'
+down_revision = '8f2b1c3d4e5a'
+branch_labels = None
+depends_on = None
+
+# (table, favorite column, referenced table)
+FAVORITES = (
+    ('favorites_planets', 'planet_id', 'planets'),
+    ('favorites_people', 'people_id', 'people'),
+)
+
+
+def _favorites_table(table, column, target, unique):
+    # full definition, SQLite rebuilds the table from it because it can't drop the unnamed constraint
+    return sa.Table(table, sa.MetaData(),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column(column, sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint([column], [target + '.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        *([sa.UniqueConstraint(column)] if unique else [])
+    )
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for table, column, target in FAVORITES:
+        if dialect == 'sqlite':
+            with op.batch_alter_table(table, recreate='always',
+                                      copy_from=_favorites_table(table, column, target, unique=False)):
+                pass
+        # the new indexes go before dropping the old one, MySQL needs an index on the foreign key at all times
+        op.create_index(f'ix_{table}_{column}', table, [column], unique=False)
+        op.create_index(f'ix_{table}_user_id_{column}', table, ['user_id', column], unique=True,
+                        postgresql_include=['id'])
+        if dialect == 'mysql':
+            op.drop_index(column, table_name=table)
+        elif dialect != 'sqlite':
+            op.drop_constraint(f'{table}_{column}_key', table, type_='unique')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table, column, target in FAVORITES:
+        if dialect != 'sqlite':
+            op.create_unique_constraint(f'{table}_{column}_key' if dialect != 'mysql' else column, table, [column])
+        op.drop_index(f'ix_{table}_user_id_{column}', table_name=table)
+        op.drop_index(f'ix_{table}_{column}', table_name=table)
+        if dialect == 'sqlite':
+            with op.batch_alter_table(table, recreate='always',
+                                      copy_from=_favorites_table(table, column, target, unique=True)):
+                pass
@@ -0,0 +1,32 @@
+"""table versions for ETags
+
+Revision ID: 8f2b1c3d4e5a
+Revises: 5462b6c22c77
+Create Date: 2026-10-18 09:12:40.118532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f2b1c3d4e5a'
+down_revision = '5462b6c22c77'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_versions = op.create_table('table_versions',
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_versions, [
+        {'name': name, 'version': 0}
+        for name in ('user', 'people', 'planets', 'favorites_people', 'favorites_planets')
+    ])
+
+
+def downgrade():
+    op.drop_table('table_versions')
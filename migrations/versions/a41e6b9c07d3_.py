@@ -0,0 +1,66 @@
+"""indexes for filters, sorting and name search
+
+Revision ID: a41e6b9c07d3
+Revises: 3c9d0e7f1a2b
+Create Date: 2026-10-18 11:26:03.871204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41e6b9c07d3'
+down_revision = '3c9d0e7f1a2b'
+branch_labels = None
+depends_on = None
+
+INDEXED_COLUMNS = {
+    'people': ('gender', 'height', 'mass', 'hair_color', 'eye_color'),
+    'planets': ('diameter', 'population', 'climate', 'terrain'),
+}
+
+
+def _sqlite_search(table):
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(name, content='{table}', content_rowid='id')",
+        f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')",
+        f"CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {table}_fts(rowid, name) VALUES (new.id, new.name); END",
+        f"CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {table}_fts({table}_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+        f"CREATE TRIGGER {table}_fts_update AFTER UPDATE OF name ON {table} BEGIN "
+        f"INSERT INTO {table}_fts({table}_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+        f"INSERT INTO {table}_fts(rowid, name) VALUES (new.id, new.name); END",
+    ]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for table, columns in INDEXED_COLUMNS.items():
+        for column in columns:
+            op.create_index(f'ix_{table}_{column}', table, [column], unique=False)
+
+    if dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for table in INDEXED_COLUMNS:
+            op.execute(f"CREATE INDEX ix_{table}_name_trgm ON {table} USING gin (name gin_trgm_ops)")
+    elif dialect == 'sqlite':
+        for table in INDEXED_COLUMNS:
+            for statement in _sqlite_search(table):
+                op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for table in INDEXED_COLUMNS:
+            op.execute(f"DROP INDEX IF EXISTS ix_{table}_name_trgm")
+    elif dialect == 'sqlite':
+        for table in INDEXED_COLUMNS:
+            for trigger in ('insert', 'delete', 'update'):
+                op.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{trigger}")
+            op.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+    for table, columns in INDEXED_COLUMNS.items():
+        for column in columns:
+            op.drop_index(f'ix_{table}_{column}', table_name=table)
@@ -0,0 +1,41 @@
+"""favorites_count counters on people and planets
+
+Revision ID: c6e2a9d4b817
+Revises: a41e6b9c07d3
+Create Date: 2026-10-18 15:41:09.273518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e2a9d4b817'
+down_revision = 'a41e6b9c07d3'
+branch_labels = None
+depends_on = None
+
+# (counted table, favorites table, favorite column)
+COUNTERS = (
+    ('people', 'favorites_people', 'people_id'),
+    ('planets', 'favorites_planets', 'planet_id'),
+)
+
+
+def upgrade():
+    for table, favorites, column in COUNTERS:
+        op.add_column(table, sa.Column('favorites_count', sa.Integer(), nullable=False, server_default='0'))
+        op.execute(f"UPDATE {table} SET favorites_count = "
+                   f"(SELECT count(*) FROM {favorites} WHERE {favorites}.{column} = {table}.id)")
+        op.create_index(f'ix_{table}_favorites_count_id', table, ['favorites_count', 'id'], unique=False)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table, _, _ in COUNTERS:
+        op.drop_index(f'ix_{table}_favorites_count_id', table_name=table)
+        if dialect == 'sqlite':
+            # ALTER TABLE ... DROP COLUMN (SQLite 3.35+), a batch rebuild would lose the FTS triggers
+            op.execute(f"ALTER TABLE {table} DROP COLUMN favorites_count")
+        else:
+            op.drop_column(table, 'favorites_count')
@@ -1,20 +1,181 @@
+"""
+Flask-Admin runs as its own Flask app so the API workers never import it at boot: app.py mounts it
+on /admin and builds it on the first request there (ADMIN_MODE=lazy, the default).
+With ADMIN_MODE=off the API leaves /admin alone and the admin can run in a separate process:
+    gunicorn "admin:create_admin_app()" --chdir ./src/
+
+The list views are tuned for large tables:
+- only indexed columns are sortable, so every ORDER BY walks an index
+- related rows (the user and planet of a favorite) are joined in the list query, and picked
+  with ajax lookups in the forms instead of a <select> of the whole table
+- pages are read with a deferred join: the OFFSET runs on the ids only, the full rows are
+  fetched for the ids of the page
+- tables over ADMIN_EXACT_COUNT_LIMIT rows (100000) show an estimated count when the list isn't
+  searched or filtered (pg_class.reltuples on Postgres, the highest id elsewhere)
+- with ADMIN_READ_DATABASE_URL the lists and counts are read from that database (a read replica),
+  the forms still read and write the primary
+"""
 import os
+from flask import Flask, g
 from flask_admin import Admin
-from models import db, User, People, Planets, FavoritePeople, FavoritePlanets
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+from models import db, User, People, Planets, FavoritePeople, FavoritePlanets, FAVORITE_COUNTERS, bump_version, \
+    count_favorites
 from flask_admin.contrib.sqla import ModelView
+from utils import configure_database, engine_options
+
+EXACT_COUNT_LIMIT = int(os.getenv("ADMIN_EXACT_COUNT_LIMIT", 100000))
+
+
+class KnownCount:
+    # stands in for the count query of Flask-Admin, which only calls scalar() on it
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+
+class VersionedModelView(ModelView):
+    # edits made from the admin also have to change the ETags of the API
+    def on_model_change(self, form, model, is_created):
+        bump_version(self.model.__tablename__)
+
+    def on_model_delete(self, model):
+        bump_version(self.model.__tablename__)
+
+
+class ScalableModelView(VersionedModelView):
+    column_default_sort = ("id", True)
+    column_display_pk = True
+
+    def __init__(self, model, session, **kwargs):
+        table = model.__table__
+        # every column that leads an index (or is the primary key) can be sorted on
+        indexed = {column.key for column in table.columns if column.primary_key or column.index or column.unique}
+        indexed.update(next(iter(index.columns)).key for index in table.indexes)
+        self.column_sortable_list = [column.key for column in table.columns if column.key in indexed]
+        super().__init__(model, session, **kwargs)
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        # only the list (and its count) goes to the replica, the actions re-read the rows on the primary
+        g.admin_listing = True
+        g.admin_unfiltered = not search and not filters
+        try:
+            return super().get_list(page, sort_column, sort_desc, search, filters, execute, page_size)
+        finally:
+            g.admin_listing = False
+
+    def list_session(self):
+        if not g.get("admin_listing") or "admin_read" not in db.engines:
+            return self.session
+        if "admin_read_session" not in g:
+            g.admin_read_session = Session(db.engines["admin_read"])
+        return g.admin_read_session
+
+    def get_query(self):
+        return self.list_session().query(self.model)
+
+    def get_count_query(self):
+        session = self.list_session()
+        if g.get("admin_unfiltered"):
+            estimate = self.estimate_count(session)
+            if estimate is not None and estimate > EXACT_COUNT_LIMIT:
+                return KnownCount(estimate)
+        return session.query(func.count('*')).select_from(self.model)
+
+    def estimate_count(self, session):
+        if session.get_bind().dialect.name == "postgresql":
+            # -1 until the table has been analyzed once
+            estimate = session.scalar(text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+                                      {"table": self.model.__tablename__})
+            return estimate if estimate is not None and estimate >= 0 else None
+        # the end of the primary key index, deleted rows make it an overestimate
+        return session.scalar(select(func.max(self.model.id)))
+
+    def _apply_pagination(self, query, page, page_size):
+        if page_size is None:
+            page_size = self.page_size
+        if not page or not page_size:
+            return super()._apply_pagination(query, page, page_size)
+        # deferred join: skip the first pages on the ids alone, then load the rows of this page
+        ids = query.with_entities(self.model.id).limit(page_size).offset(page * page_size).subquery()
+        return query.filter(self.model.id.in_(select(ids.c.id))).limit(page_size)
+
+
+class UserView(ScalableModelView):
+    column_exclude_list = ("password",)
+    column_searchable_list = ("email",)
+
+
+class CatalogView(ScalableModelView):
+    column_searchable_list = ("name",)
+    form_excluded_columns = ("favorites_count",)
+
+    def __init__(self, model, session, **kwargs):
+        self.column_filters = model.FILTER_FIELDS + model.RANGE_FIELDS
+        super().__init__(model, session, **kwargs)
+
+
+class FavoriteView(ScalableModelView):
+    # favorites created and deleted here move the counters too, an edit pointing a favorite
+    # elsewhere is left to `flask reconcile-favorites`
+    def on_model_change(self, form, model, is_created):
+        super().on_model_change(form, model, is_created)
+        if is_created:
+            self.session.flush()
+            count_favorites(self.model, [getattr(model, FAVORITE_COUNTERS[self.model][1])], 1)
+
+    def on_model_delete(self, model):
+        super().on_model_delete(model)
+        count_favorites(self.model, [getattr(model, FAVORITE_COUNTERS[self.model][1])], -1)
+
+
+class FavoritePlanetsView(FavoriteView):
+    column_list = ("id", "user", "planets")
+    column_select_related_list = (FavoritePlanets.user, FavoritePlanets.planets)
+    column_searchable_list = ("user.email", "planets.name")
+    form_ajax_refs = {"user": {"fields": ("email",)}, "planets": {"fields": ("name",)}}
+
+
+class FavoritePeopleView(FavoriteView):
+    column_list = ("id", "user", "people")
+    column_select_related_list = (FavoritePeople.user, FavoritePeople.people)
+    column_searchable_list = ("user.email", "people.name")
+    form_ajax_refs = {"user": {"fields": ("email",)}, "people": {"fields": ("name",)}}
+
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
+
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(People, db.session))
-    admin.add_view(ModelView(Planets, db.session))
-    admin.add_view(ModelView(FavoritePeople, db.session))
-    admin.add_view(ModelView(FavoritePlanets, db.session))
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(CatalogView(People, db.session))
+    admin.add_view(CatalogView(Planets, db.session))
+    admin.add_view(FavoritePeopleView(FavoritePeople, db.session))
+    admin.add_view(FavoritePlanetsView(FavoritePlanets, db.session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ScalableModelView(YourModelName, db.session))
+
+    @app.teardown_appcontext
+    def close_read_session(error):
+        read_session = g.pop("admin_read_session", None)
+        if read_session is not None:
+            read_session.close()
+
+def create_admin_app():
+    app = Flask(__name__)
+    configure_database(app)
+    read_url = os.getenv("ADMIN_READ_DATABASE_URL")
+    if read_url:
+        read_url = read_url.replace("postgres://", "postgresql://")
+        app.config['SQLALCHEMY_BINDS'] = {**app.config.get('SQLALCHEMY_BINDS', {}),
+                                          "admin_read": {"url": read_url, **engine_options(read_url)}}
+    db.init_app(app)
+    setup_admin(app)
+    return app
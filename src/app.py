@@ -2,76 +2,175 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+from flask import Blueprint, Flask, current_app, request, jsonify, make_response
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User , People , Planets , FavoritePeople , FavoritePlanets
+from sqlalchemy.orm import joinedload
+from utils import APIException, LazyMount, configure_database, env_flag, generate_sitemap, pool_stats, \
+    is_paginated, paginate, wants_stream, stream_response, conditional, parse_fields, parse_include, project, ordered, \
+    patch_values, row_values
+from cache import cache
+from compress import setup_compression
+from json_provider import setup_json
+from profiling import setup_profiling
+from replicas import replica_reads, setup_replicas
+from metrics import setup_metrics
+from filters import filter_and_sort
+from bulk import read_items, bulk_create, bulk_update, bulk_delete, bulk_status
+from jobs import WARM_PATHS, accepted, enqueue, job_stats
+from models import db, User , People , Planets , FavoritePeople , FavoritePlanets, Job, bump_version, count_favorites, \
+    favorites_query, insert_or_get, reconcile_favorite_counts, update_row, upsert
 #from models import Person
 
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+api = Blueprint('api', __name__)
+# default size of the /people/top and /planets/top leaderboards
+TOP_SIZE = 10
+
+def create_app():
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    configure_database(app)
+
+    db.init_app(app)
+    setup_replicas(app, db)
+    if env_flag("FLASK_RUN_FROM_CLI"):
+        # only the flask command (`flask db upgrade`...) needs Alembic, the gunicorn workers never import it
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    CORS(app)
+    cache.init_app(app)
+    setup_json(app)
+    setup_profiling(app)
+    setup_metrics(app, db, cache)
+    setup_compression(app)
+    app.register_blueprint(api)
+    mount_admin(app)
+
+    @app.cli.command("reconcile-favorites")
+    def reconcile_favorites():
+        """Recount the favorites of every planet and character, fixing the counters that drifted."""
+        print(f"{reconcile_favorite_counts()} counters fixed")
+
+    return app
+
+def mount_admin(app):
+    if os.getenv("ADMIN_MODE", "lazy") == "off":
+        return
+
+    def create_admin():
+        from admin import create_admin_app
+        return create_admin_app()
+
+    app.wsgi_app = LazyMount(app.wsgi_app, "/admin", create_admin)
 
 # Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
+# hit/miss/eviction counters of the response cache (per worker)
+@api.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(cache.stats()), 200
+
+# fills the response cache in the background, the first pages of the lists without a body
+@api.route('/cache/warm', methods=['POST'])
+def warm_cache():
+    paths = (request.get_json(silent=True) or {}).get("paths", list(WARM_PATHS))
+    if not isinstance(paths, list) or not all(isinstance(path, str) and path.startswith("/") for path in paths):
+        raise APIException("Expected paths, a list of paths starting with /", status_code=400)
+    return accepted(enqueue("warm_cache", {"paths": paths}))
+
+# live pool statistics of this worker, to size DB_POOL_SIZE / DB_MAX_OVERFLOW
+@api.route('/internal/pool', methods=['GET'])
+def get_pool_stats():
+    token = os.getenv("INTERNAL_API_TOKEN")
+    if token and request.headers.get("X-Internal-Token") != token:
+        raise APIException("Forbidden", status_code=403)
+    return jsonify(pool_stats(db.engine)), 200
+
 # generate sitemap with all your endpoints
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    response = make_response(generate_sitemap(current_app))
+    response.headers["Cache-Control"] = "public, max-age=3600"
+    # weak: the same tag goes out gzipped or not
+    response.add_etag(weak=True)
+    return response.make_conditional(request)
+
+# liveness for the load balancer: the process answers, nothing else is checked
+@api.route('/healthz', methods=['GET'])
+def healthz():
+    return "ok", 200, {"Content-Type": "text/plain", "Cache-Control": "no-store"}
+
+# readiness: the database answers and the pool still has room for this worker
+@api.route('/readyz', methods=['GET'])
+def readyz():
+    # a pool with nothing left to hand out would block the check itself for pool_timeout
+    pool = pool_stats(db.engine)
+    if pool.get("exhausted"):
+        return jsonify({"ready": False, "pool": pool}), 503, {"Cache-Control": "no-store"}
+    try:
+        db.session.execute(db.text("SELECT 1"))
+    except Exception as error:
+        db.session.rollback()
+        return jsonify({"ready": False, "pool": pool, "database": str(error)}), 503, {"Cache-Control": "no-store"}
+    return jsonify({"ready": True, "pool": pool}), 200, {"Cache-Control": "no-store"}
 
 ###############################################################################################
 ######################################  USERS  ################################################
 ###############################################################################################
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/user', methods=['GET'])
+@api.route('/user', methods=['GET'])
+@replica_reads
+@conditional("user")
 def get_all_user():
 
-    users_query = User.query.all()
-    users_list = list(map(lambda user: user.serialize(),users_query))
+    fields = parse_fields(request.args, User)
+    query = project(User.query, User, fields)
+
+    if wants_stream(request):
+        return stream_response(request, query.order_by(User.id), lambda user: user.serialize(fields))
+
+    if is_paginated(request.args):
+        users_page, next_cursor = paginate(query, User, request.args)
+        users_list = list(map(lambda user: user.serialize(fields),users_page))
+        return jsonify({"results":users_list,"next":next_cursor}), 200
+
+    users_query = query.all()
+    users_list = list(map(lambda user: user.serialize(fields),users_query))
 
     return jsonify(users_list), 200
 
 # ---------------------------------------------------------------------------------------------
+# ?include= of /user/<id>: the User backrefs that can be embedded and the model serializing their rows
+USER_INCLUDES = {"favorites_planets": FavoritePlanets, "favorites_people": FavoritePeople}
 
-@app.route('/user/<int:user_id>', methods=['GET'])
+@api.route('/user/<int:user_id>', methods=['GET'])
+@replica_reads
+@conditional("user", "favorites_planets", "favorites_people", "planets", "people")
 def get_user(user_id):
 
-    user = User.query.filter_by(id=user_id).first()
+    fields = parse_fields(request.args, User)
+    include = parse_include(request.args, USER_INCLUDES)
+    loaded = fields + ["full_name"] if include and fields is not None else fields  # favorites carry the first name
+    user = project(User.query, User, loaded).filter_by(id=user_id).first()
     if user is None:
         return jsonify({"info":"Not Found"}), 404
-    
-    print(user.favorites_planets)
-    print(user.favorites_people)
 
-    response = user.serialize()
-    response["favorites_planets"] = list(
-        map(lambda planet:planet.serialize(), user.favorites_planets))
-    response["favorites_people"] = list(
-        map(lambda people:people.serialize(), user.favorites_people))
+    response = user.serialize(fields)
+    for kind in include:
+        response[kind] = []
+    if include:
+        # every favorite with its planet or character name in a second and last statement
+        for row in db.session.execute(favorites_query(user_id, include)):
+            response[row.kind].append(USER_INCLUDES[row.kind].serialize_row(row, user.first_name))
 
     return jsonify(response), 200
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/user', methods=['POST'])
+@api.route('/user', methods=['POST'])
 def create_user():
     user_body = request.get_json()
     user_db = User(first_name = user_body["first_name"],
@@ -80,45 +179,32 @@ def create_user():
                    password = user_body["password"],
                    is_active = user_body["is_active"])
     db.session.add(user_db)
+    bump_version("user")
     db.session.commit()
     return jsonify(user_db.serialize()), 201
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/user/<int:user_id>', methods=['PATCH'])
+@api.route('/user/<int:user_id>', methods=['PATCH'])
 def update_user(user_id):
 
-    user_db = User.query.filter_by(id=user_id).first()
+    user_db = update_row(User, user_id, patch_values(User, request.get_json()))
     if user_db is None:
         return jsonify({"info":"Not Found"}), 404
-    user_body = request.get_json()
-    
-    if "first_name" in user_body:
-        user_db.first_name = user_body["first_name"]
-    if "last_name" in user_body:
-        user_db.last_name = user_body["last_name"]
-    if "email" in user_body:
-        user_db.email = user_body["email"]
-    if "password" in user_body:
-        user_db.password = user_body["password"]
-    if "is_active" in user_body:
-        user_db.is_active = user_body["is_active"]
-
-    db.session.add(user_db)
+    response = user_db.serialize()
+    bump_version("user")
     db.session.commit()
-    return jsonify(user_db.serialize())
+    return jsonify(response)
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/user/<int:user_id>', methods=['DELETE'])
+# the user and all their favorites go in a background job, GET /jobs/<id> says when it's done
+@api.route('/user/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
 
-    user_db = User.query.filter_by(id=user_id).first()
-    if user_db is None:
+    if db.session.get(User, user_id) is None:
         return jsonify({"info":"Not Found"}), 404
-    db.session.delete(user_db)
-    db.session.commit()
-    return jsonify({"info":"User deleted"})
+    return accepted(enqueue("delete_user", {"user_id": user_id}))
     
 ###############################################################################################
 ######################################  PEOPLE  ###############################################
@@ -126,29 +212,66 @@ def delete_user(user_id):
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/people', methods=['GET'])
+@api.route('/people', methods=['GET'])
+@replica_reads
+@conditional("people")
+@cache.cached("people")
 def get_people():
 
-    people_query = People.query.all()
-    people_list = list(map(lambda people: people.serialize(),people_query))
+    fields = parse_fields(request.args, People)
+    query, order = filter_and_sort(People.query, People, request.args)
+    query = project(query, People, fields, order)
+
+    if wants_stream(request):
+        return stream_response(request, ordered(query, order + [(People.id, False)]),
+                               lambda people: people.serialize(fields))
+
+    if is_paginated(request.args):
+        people_page, next_cursor = paginate(query, People, request.args, order)
+        people_list = list(map(lambda people: people.serialize(fields),people_page))
+        return jsonify({"results":people_list,"next":next_cursor}), 200
+
+    people_query = ordered(query, order).all()
+    people_list = list(map(lambda people: people.serialize(fields),people_query))
 
     return jsonify(people_list), 200
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/people/<int:people_id>', methods=['GET'])
+# most favorited characters, read from the (favorites_count, id) index: O(limit) whatever the
+# number of favorites. ?limit= (10) and the next cursor work as in the other lists
+@api.route('/people/top', methods=['GET'])
+@replica_reads
+@conditional("people", "favorites_people")
+def get_top_people():
+
+    fields = parse_fields(request.args, People)
+    order = [(People.favorites_count, True), (People.id, True)]
+    query = project(People.query, People, fields, order)
+    people_page, next_cursor = paginate(query, People, {"limit": TOP_SIZE, **request.args}, order)
+    people_list = [dict(people.serialize(fields), favorites_count=people.favorites_count) for people in people_page]
+
+    return jsonify({"results":people_list,"next":next_cursor}), 200
+
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/people/<int:people_id>', methods=['GET'])
+@replica_reads
+@conditional("people")
+@cache.cached("people", item_arg="people_id")
 def get_single_people(people_id):
 
-    people = People.query.filter_by(id=people_id).first()
+    fields = parse_fields(request.args, People)
+    people = project(People.query, People, fields).filter_by(id=people_id).first()
     if people is None:
         return jsonify({"info":"Not Found"}), 404
 
-    return jsonify(people.serialize()), 200
+    return jsonify(people.serialize(fields)), 200
 
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/people', methods=['POST'])
+@api.route('/people', methods=['POST'])
 def create_people():
     body = request.get_json()
     people_db = People(
@@ -162,82 +285,143 @@ def create_people():
         birth_year = body["birth_year"]
         )
     db.session.add(people_db)
+    bump_version("people")
     db.session.commit()
+    cache.invalidate("people")
     return jsonify(people_db.serialize()), 201
 
+# ---------------------------------------------------------------------------------------------
+# create or replace by name in one INSERT ... ON CONFLICT (name) DO UPDATE, safe to retry
+@api.route('/people', methods=['PUT'])
+def upsert_people():
+    people_db = upsert(People, row_values(People, request.get_json()), ("name",))
+    response = people_db.serialize()
+    bump_version("people")
+    db.session.commit()
+    cache.invalidate("people", people_db.id)
+    return jsonify(response), 200
+
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/people/<int:people_id>', methods=['PATCH'])
+@api.route('/people/<int:people_id>', methods=['PATCH'])
 def update_people(people_id):
 
-    people_db = People.query.filter_by(id=people_id).first()
+    people_db = update_row(People, people_id, patch_values(People, request.get_json()))
     if people_db is None:
         return jsonify({"info":"Not Found"}), 404
-    body = request.get_json()
-    
-    if "name" in body:
-        people_db.name = body["name"]
-    if "gender" in body:
-        people_db.gender = body["gender"]
-    if "height" in body:
-        people_db.height = body["height"]
-    if "mass" in body:
-        people_db.mass = body["mass"]
-    if "hair_color" in body:
-        people_db.hair_color = body["hair_color"]
-    if "skin_color" in body:
-        people_db.skin_color = body["skin_color"]
-    if "eye_color" in body:
-        people_db.eye_color = body["eye_color"]
-    if "birth_year" in body:
-        people_db.birth_year = body["birth_year"]
-
-
-
-    db.session.add(people_db)
+    response = people_db.serialize()
+    bump_version("people")
     db.session.commit()
-    return jsonify(people_db.serialize())
+    cache.invalidate("people", people_id)
+    return jsonify(response)
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/people/<int:people_id>', methods=['DELETE'])
+@api.route('/people/<int:people_id>', methods=['DELETE'])
 def delete_people(people_id):
 
     people_db = People.query.filter_by(id=people_id).first()
     if people_db is None:
         return jsonify({"info":"Not Found"}), 404
     db.session.delete(people_db)
+    bump_version("people")
     db.session.commit()
+    cache.invalidate("people", people_id)
     return jsonify({"info":"People deleted"})
     
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/people/bulk', methods=['POST'])
+def bulk_create_people():
+    report = bulk_create(People, read_items(request),
+        on_commit=lambda rows: cache.invalidate("people"))
+    return jsonify(report), bulk_status(report)
+
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/people/bulk', methods=['PATCH'])
+def bulk_update_people():
+    report = bulk_update(People, read_items(request),
+        on_commit=lambda rows: [cache.invalidate("people", row["id"]) for row in rows])
+    return jsonify(report), bulk_status(report)
+
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/people/bulk', methods=['DELETE'])
+def bulk_delete_people():
+    report = bulk_delete(People, read_items(request),
+        on_commit=lambda rows: [cache.invalidate("people", row["id"]) for row in rows])
+    return jsonify(report), bulk_status(report)
+
+# ---------------------------------------------------------------------------------------------
+# same items as POST /people/bulk, written by a background job, the report ends up on the job
+@api.route('/people/import', methods=['POST'])
+def import_people():
+    return accepted(enqueue("import", {"table": "people", "items": list(read_items(request))}))
+    
 ###############################################################################################
 ######################################  PLANETS  ##############################################
 ###############################################################################################
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/planets', methods=['GET'])
+@api.route('/planets', methods=['GET'])
+@replica_reads
+@conditional("planets")
+@cache.cached("planets")
 def get_planets():
 
-    planets_query = Planets.query.all()
-    planets_list = list(map(lambda planet: planet.serialize(),planets_query))
+    fields = parse_fields(request.args, Planets)
+    query, order = filter_and_sort(Planets.query, Planets, request.args)
+    query = project(query, Planets, fields, order)
+
+    if wants_stream(request):
+        return stream_response(request, ordered(query, order + [(Planets.id, False)]),
+                               lambda planet: planet.serialize(fields))
+
+    if is_paginated(request.args):
+        planets_page, next_cursor = paginate(query, Planets, request.args, order)
+        planets_list = list(map(lambda planet: planet.serialize(fields),planets_page))
+        return jsonify({"results":planets_list,"next":next_cursor}), 200
+
+    planets_query = ordered(query, order).all()
+    planets_list = list(map(lambda planet: planet.serialize(fields),planets_query))
 
     return jsonify(planets_list), 200
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/planets/<int:planet_id>', methods=['GET'])
+@api.route('/planets/top', methods=['GET'])
+@replica_reads
+@conditional("planets", "favorites_planets")
+def get_top_planets():
+
+    fields = parse_fields(request.args, Planets)
+    order = [(Planets.favorites_count, True), (Planets.id, True)]
+    query = project(Planets.query, Planets, fields, order)
+    planets_page, next_cursor = paginate(query, Planets, {"limit": TOP_SIZE, **request.args}, order)
+    planets_list = [dict(planet.serialize(fields), favorites_count=planet.favorites_count) for planet in planets_page]
+
+    return jsonify({"results":planets_list,"next":next_cursor}), 200
+
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/planets/<int:planet_id>', methods=['GET'])
+@replica_reads
+@conditional("planets")
+@cache.cached("planets", item_arg="planet_id")
 def get_single_planets(planet_id):
 
-    planet = Planets.query.filter_by(id=planet_id).first()
+    fields = parse_fields(request.args, Planets)
+    planet = project(Planets.query, Planets, fields).filter_by(id=planet_id).first()
     if planet is None:
         return jsonify({"info":"Not Found"}), 404
 
-    return jsonify(planet.serialize()), 200
+    return jsonify(planet.serialize(fields)), 200
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/planets', methods=['POST'])
+@api.route('/planets', methods=['POST'])
 def create_planet():
     body = request.get_json()
     planet_db = Planets(
@@ -252,123 +436,221 @@ def create_planet():
         terrain = body["terrain"]
         )
     db.session.add(planet_db)
+    bump_version("planets")
     db.session.commit()
+    cache.invalidate("planets")
     return jsonify(planet_db.serialize()), 201
 
 # ---------------------------------------------------------------------------------------------
+# create or replace by name in one INSERT ... ON CONFLICT (name) DO UPDATE, safe to retry
+@api.route('/planets', methods=['PUT'])
+def upsert_planet():
+    planet_db = upsert(Planets, row_values(Planets, request.get_json()), ("name",))
+    response = planet_db.serialize()
+    bump_version("planets")
+    db.session.commit()
+    cache.invalidate("planets", planet_db.id)
+    return jsonify(response), 200
 
-@app.route('/planets/<int:planet_id>', methods=['PATCH'])
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/planets/<int:planet_id>', methods=['PATCH'])
 def update_planet(planet_id):
 
-    planet_db = Planets.query.filter_by(id=planet_id).first()
+    planet_db = update_row(Planets, planet_id, patch_values(Planets, request.get_json()))
     if planet_db is None:
         return jsonify({"info":"Not Found"}), 404
-    body = request.get_json()
-    
-    if "climate" in body:
-        planet_db.climate = body["climate"]
-    if "diameter" in body:
-        planet_db.diameter = body["diameter"]
-    if "gravity" in body:
-        planet_db.gravity = body["gravity"]
-    if "name" in body:
-        planet_db.name = body["name"]
-    if "orbital_period" in body:
-        planet_db.orbital_period = body["orbital_period"]
-    if "population" in body:
-        planet_db.population = body["population"]
-    if "rotation_period" in body:
-        planet_db.rotation_period = body["rotation_period"]
-    if "surface_water" in body:
-        planet_db.surface_water = body["surface_water"]
-    if "terrain" in body:
-        planet_db.terrain = body["terrain"]
-
-
-
-    db.session.add(planet_db)
+    response = planet_db.serialize()
+    bump_version("planets")
     db.session.commit()
-    return jsonify(planet_db.serialize())
+    cache.invalidate("planets", planet_id)
+    return jsonify(response)
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/planets/<int:planet_id>', methods=['DELETE'])
+@api.route('/planets/<int:planet_id>', methods=['DELETE'])
 def delete_planet(planet_id):
 
     planet_db = Planets.query.filter_by(id=planet_id).first()
     if planet_db is None:
         return jsonify({"info":"Not Found"}), 404
     db.session.delete(planet_db)
+    bump_version("planets")
     db.session.commit()
+    cache.invalidate("planets", planet_id)
     return jsonify({"info":"Planet deleted"})
 
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/planets/bulk', methods=['POST'])
+def bulk_create_planets():
+    report = bulk_create(Planets, read_items(request),
+        on_commit=lambda rows: cache.invalidate("planets"))
+    return jsonify(report), bulk_status(report)
+
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/planets/bulk', methods=['PATCH'])
+def bulk_update_planets():
+    report = bulk_update(Planets, read_items(request),
+        on_commit=lambda rows: [cache.invalidate("planets", row["id"]) for row in rows])
+    return jsonify(report), bulk_status(report)
+
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/planets/bulk', methods=['DELETE'])
+def bulk_delete_planets():
+    report = bulk_delete(Planets, read_items(request),
+        on_commit=lambda rows: [cache.invalidate("planets", row["id"]) for row in rows])
+    return jsonify(report), bulk_status(report)
+
+# ---------------------------------------------------------------------------------------------
+# same items as POST /planets/bulk, written by a background job, the report ends up on the job
+@api.route('/planets/import', methods=['POST'])
+def import_planets():
+    return accepted(enqueue("import", {"table": "planets", "items": list(read_items(request))}))
+    
 ###############################################################################################
 #####################################  FAVORITES  #############################################
 ###############################################################################################
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/users/favorites', methods=['GET'])
+@api.route('/users/favorites', methods=['GET'])
 def get_users_favorites():
+    # kept for the existing clients, it always returned the favorites of the first user
+    return get_user_favorites(1)
+
+# ---------------------------------------------------------------------------------------------
 
-    favorite_planets = FavoritePlanets.query.filter_by(user_id=1)
-    favorite_planets_list = list(map(lambda planet: planet.serialize(),favorite_planets))
+@api.route('/users/<int:user_id>/favorites', methods=['GET'])
+@replica_reads
+@conditional("user", "favorites_planets", "favorites_people", "planets", "people")
+def get_user_favorites(user_id):
 
-    favorite_people = FavoritePeople.query.filter_by(user_id=1)
-    favorite_people_list = list(map(lambda people: people.serialize(),favorite_people))
+    fields = parse_fields(request.args, FavoritePlanets, FavoritePeople)
+    favorite_planets = FavoritePlanets.query.options(
+        joinedload(FavoritePlanets.user), joinedload(FavoritePlanets.planets)).filter_by(user_id=user_id)
+    favorite_people = FavoritePeople.query.options(
+        joinedload(FavoritePeople.user), joinedload(FavoritePeople.people)).filter_by(user_id=user_id)
+
+    if wants_stream(request):
+        return stream_response(request, {"planets":favorite_planets,"people":favorite_people},
+                               lambda favorite: favorite.serialize(fields))
+
+    favorite_planets_list = list(map(lambda planet: planet.serialize(fields),favorite_planets))
+    favorite_people_list = list(map(lambda people: people.serialize(fields),favorite_people))
 
     return jsonify({"planets":favorite_planets_list,"people":favorite_people_list})
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/favorite/planet/<int:planet_id>', methods=['POST'])
+@api.route('/favorite/planet/<int:planet_id>', methods=['POST'])
 def create_favorite_planet(planet_id):
     body = request.get_json()
-    favorite_planet_db = FavoritePlanets(
-        user_id = body["user_id"],
-        planet_id = planet_id
-        )
-    db.session.add(favorite_planet_db)
+    # a retried request gets back the favorite it created the first time, with a 200
+    favorite_id, created = insert_or_get(
+        FavoritePlanets, {"user_id": body["user_id"], "planet_id": planet_id}, ("user_id", "planet_id"))
+    if created:
+        count_favorites(FavoritePlanets, [planet_id], 1)
+        bump_version("favorites_planets")
     db.session.commit()
-    return jsonify(favorite_planet_db.serialize()), 201
+    favorite_planet_db = db.session.get(FavoritePlanets, favorite_id, options=[
+        joinedload(FavoritePlanets.user), joinedload(FavoritePlanets.planets)])
+    return jsonify(favorite_planet_db.serialize()), 201 if created else 200
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/favorite/people/<int:people_id>', methods=['POST'])
+@api.route('/favorite/people/<int:people_id>', methods=['POST'])
 def create_favorite_people(people_id):
     body = request.get_json()
-    favorite_people_db = FavoritePeople(
-        user_id = body["user_id"],
-        people_id = people_id
-        )
-    db.session.add(favorite_people_db)
+    favorite_id, created = insert_or_get(
+        FavoritePeople, {"user_id": body["user_id"], "people_id": people_id}, ("user_id", "people_id"))
+    if created:
+        count_favorites(FavoritePeople, [people_id], 1)
+        bump_version("favorites_people")
     db.session.commit()
-    return jsonify(favorite_people_db.serialize()), 201
+    favorite_people_db = db.session.get(FavoritePeople, favorite_id, options=[
+        joinedload(FavoritePeople.user), joinedload(FavoritePeople.people)])
+    return jsonify(favorite_people_db.serialize()), 201 if created else 200
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/favorite/planet/<int:planet_id>', methods=['DELETE'])
+@api.route('/favorite/planet/<int:planet_id>', methods=['DELETE'])
 def delete_favorite_planet(planet_id):
     favorite_planet_db = FavoritePlanets.query.filter_by(id=planet_id, user_id=1).first()
     if favorite_planet_db is None:
         return jsonify({"info":"Not Found"}), 404
     db.session.delete(favorite_planet_db)
+    count_favorites(FavoritePlanets, [favorite_planet_db.planet_id], -1)
+    bump_version("favorites_planets")
     db.session.commit()
     return jsonify({"info":"Favorite planet deleted"})
 
 # ---------------------------------------------------------------------------------------------
 
-@app.route('/favorite/people/<int:people_id>', methods=['DELETE'])
+@api.route('/favorite/people/<int:people_id>', methods=['DELETE'])
 def delete_favorite_people(people_id):
     favorite_people_db = FavoritePeople.query.filter_by(id=people_id, user_id=1).first()
     if favorite_people_db is None:
         return jsonify({"info":"Not Found"}), 404
     db.session.delete(favorite_people_db)
+    count_favorites(FavoritePeople, [favorite_people_db.people_id], -1)
+    bump_version("favorites_people")
     db.session.commit()
     return jsonify({"info":"Favorite people deleted"})
 
 
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/favorite/planet/bulk', methods=['POST'])
+def bulk_create_favorite_planets():
+    report = bulk_create(FavoritePlanets, read_items(request))
+    return jsonify(report), bulk_status(report)
+
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/favorite/people/bulk', methods=['POST'])
+def bulk_create_favorite_people():
+    report = bulk_create(FavoritePeople, read_items(request))
+    return jsonify(report), bulk_status(report)
+
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/favorite/planet/bulk', methods=['DELETE'])
+def bulk_delete_favorite_planets():
+    report = bulk_delete(FavoritePlanets, read_items(request))
+    return jsonify(report), bulk_status(report)
+
+# ---------------------------------------------------------------------------------------------
+
+@api.route('/favorite/people/bulk', methods=['DELETE'])
+def bulk_delete_favorite_people():
+    report = bulk_delete(FavoritePeople, read_items(request))
+    return jsonify(report), bulk_status(report)
+
+###############################################################################################
+#######################################  JOBS  ################################################
+###############################################################################################
+
+# ---------------------------------------------------------------------------------------------
+# read from the primary, a replica would still show the job queued
+@api.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    job_db = db.session.get(Job, job_id)
+    if job_db is None:
+        return jsonify({"info":"Not Found"}), 404
+    return jsonify(job_db.serialize()), 200, {"Cache-Control": "no-store"}
+
+# ---------------------------------------------------------------------------------------------
+# jobs by status and how many are due, the queue is backing up when due keeps growing
+@api.route('/jobs/stats', methods=['GET'])
+def get_job_stats():
+    return jsonify(job_stats()), 200, {"Cache-Control": "no-store"}
+
+
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
+    app = create_app()
     PORT = int(os.environ.get('PORT', 3000))
     app.run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,179 @@
+"""
+Batch writes for the bulk endpoints.
+
+Items are validated one by one and written in chunked transactions, one executemany per chunk.
+Items that fail are reported by their index in the request, they never fail the rest of the batch.
+"""
+import json
+import os
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import DBAPIError, StatementError
+from models import db, FAVORITE_COUNTERS, bump_version, count_favorites
+from utils import APIException, NDJSON_MIMETYPE, writable_fields
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 500))
+
+
+def read_items(request):
+    # JSON arrays are parsed at once, NDJSON bodies are read line by line as they arrive
+    if request.mimetype == NDJSON_MIMETYPE:
+        return _ndjson_items(request.stream)
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        raise APIException("Expected a JSON array or an application/x-ndjson body", status_code=400)
+    return items
+
+
+def _ndjson_items(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield line  # not a JSON object, reported as an item error
+
+
+def bulk_create(model, items, on_commit=None):
+    fields = writable_fields(model)
+
+    def validate(item):
+        if not isinstance(item, dict):
+            raise ValueError("Expected a JSON object")
+        missing = [field for field in fields if field not in item]
+        if missing:
+            raise ValueError("Missing fields: " + ", ".join(missing))
+        return _check_types(model, {field: item[field] for field in fields})
+
+    def execute(chunk):
+        rows = [row for _, row in chunk]
+        db.session.execute(insert(model), rows)
+        count_favorites(model, _targets(model, rows), 1)
+        return []
+
+    return _write(model, items, validate, execute, on_commit)
+
+
+def bulk_update(model, items, on_commit=None):
+    fields = writable_fields(model)
+
+    def validate(item):
+        if not isinstance(item, dict) or not isinstance(item.get("id"), int):
+            raise ValueError("Expected a JSON object with an integer id")
+        row = {field: item[field] for field in fields if field in item}
+        if not row:
+            raise ValueError("Nothing to update")
+        row["id"] = item["id"]
+        return _check_types(model, row)
+
+    def execute(chunk):
+        found = _existing_ids(model, [row["id"] for _, row in chunk])
+        rows = [row for _, row in chunk if row["id"] in found]
+        if rows:
+            # ORM bulk UPDATE by primary key, one executemany for the whole chunk
+            db.session.execute(update(model), rows)
+        return [index for index, row in chunk if row["id"] not in found]
+
+    return _write(model, items, validate, execute, on_commit)
+
+
+def bulk_delete(model, items, on_commit=None):
+    def validate(item):
+        if isinstance(item, dict):
+            item = item.get("id")
+        if not isinstance(item, int):
+            raise ValueError("Expected an integer id")
+        return {"id": item}
+
+    def execute(chunk):
+        ids = [row["id"] for _, row in chunk]
+        found = _existing_ids(model, ids)
+        if found:
+            if model in FAVORITE_COUNTERS:
+                column = getattr(model, FAVORITE_COUNTERS[model][1])
+                count_favorites(model, list(db.session.scalars(select(column).where(model.id.in_(found)))), -1)
+            db.session.execute(delete(model).where(model.id.in_(found)))
+        return [index for index, row in chunk if row["id"] not in found]
+
+    return _write(model, items, validate, execute, on_commit)
+
+
+TYPE_NAMES = {int: "an integer", str: "a string", bool: "a boolean"}
+
+
+def _check_types(model, row):
+    # SQLite stores whatever it is given and Postgres fails the statement, a value that doesn't
+    # fit its column is an item error before it reaches either (True is not an integer here)
+    columns = model.__table__.columns
+    for field, value in row.items():
+        python_type = columns[field].type.python_type
+        if value is None and columns[field].nullable:
+            continue
+        if type(value) is not python_type:
+            raise ValueError(f"{field} must be {TYPE_NAMES.get(python_type, python_type.__name__)}")
+    return row
+
+
+def _targets(model, rows):
+    # the planets or characters the favorites in rows point to, nothing for the other tables
+    if model not in FAVORITE_COUNTERS:
+        return []
+    return [row[FAVORITE_COUNTERS[model][1]] for row in rows]
+
+
+def _existing_ids(model, ids):
+    return set(db.session.scalars(select(model.id).where(model.id.in_(ids))))
+
+
+def _write(model, items, validate, execute, on_commit):
+    report = {"succeeded": 0, "errors": []}
+    chunk = []
+    for index, item in enumerate(items):
+        try:
+            chunk.append((index, validate(item)))
+        except ValueError as error:
+            report["errors"].append({"index": index, "error": str(error)})
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            _flush(model, chunk, execute, report, on_commit)
+            chunk = []
+    if chunk:
+        _flush(model, chunk, execute, report, on_commit)
+    report["errors"].sort(key=lambda error: error["index"])
+    return report
+
+
+def _flush(model, chunk, execute, report, on_commit):
+    try:
+        not_found = execute(chunk)
+        bump_version(model.__tablename__)
+        db.session.commit()
+        missing = set(not_found)
+        applied = [(index, row) for index, row in chunk if index not in missing]
+    except (DBAPIError, StatementError) as error:
+        # something in the chunk broke a constraint or has a value of the wrong type for its
+        # column, retry item by item to find out which ones. A lost connection fails the request
+        if getattr(error, "connection_invalidated", False):
+            raise
+        db.session.rollback()
+        applied, not_found = [], []
+        for index, row in chunk:
+            try:
+                with db.session.begin_nested():
+                    not_found += execute([(index, row)])
+                if index not in not_found:
+                    applied.append((index, row))
+            except (DBAPIError, StatementError) as error:
+                report["errors"].append({"index": index, "error": str(error.orig)})
+        bump_version(model.__tablename__)
+        db.session.commit()
+
+    report["succeeded"] += len(applied)
+    report["errors"] += [{"index": index, "error": "Not Found"} for index in not_found]
+    if on_commit is not None and applied:
+        on_commit([row for _, row in applied])
+
+
+def bulk_status(report):
+    # 207 Multi-Status when only part of the batch went through
+    return 207 if report["errors"] else 200
@@ -0,0 +1,189 @@
+"""
+Read-through response cache for the read-heavy catalog endpoints (people and planets).
+
+The backend is picked with the CACHE_BACKEND env variable:
+- memory (default): an in-process LRU with TTL, every gunicorn worker has its own copy
+- redis: a cache shared by all the workers, CACHE_URL points to the server
+- none: caching disabled
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, g, make_response, request
+from compress import compress_body, negotiate
+from replicas import READ_YOUR_WRITES_SECONDS
+from utils import wants_stream
+
+
+class LRUCache:
+    """In-process LRU cache where every entry also expires after `ttl` seconds"""
+
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.entries[key]
+                self.evictions += 1
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        # ttl=0 means the entry only leaves through LRU eviction (used for the generation markers)
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl if ttl else None)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisCache:
+    """
+    Cache shared by every worker. Any client with redis-py's get/set/delete signature works,
+    so fakeredis (or any local stand-in) can replace the real server.
+    """
+
+    def __init__(self, client, ttl=60):
+        self.client = client
+        self.ttl = ttl
+        self.evictions = 0  # redis evicts on its own, see INFO stats there
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(key, value, ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def __len__(self):
+        return self.client.dbsize()
+
+
+class ResponseCache:
+    """
+    Caches the body of successful GET responses.
+
+    Keys carry a generation marker: one per collection and one per item. Creating a row bumps
+    the collection generation, updating or deleting a row bumps both the collection and that
+    item's generation, so every other cached item stays valid.
+    Behind @conditional the keys also carry the table versions of the ETag, so a write served by
+    another worker, which only reaches this worker's memory backend through the database, still
+    makes the entries it changed unreachable.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        kind = os.getenv("CACHE_BACKEND", "memory")
+        ttl = int(os.getenv("CACHE_TTL", 60))
+        if kind == "memory":
+            self.backend = LRUCache(int(os.getenv("CACHE_MAX_ENTRIES", 1024)), ttl)
+        elif kind == "redis":
+            import redis
+            self.backend = RedisCache(redis.Redis.from_url(os.getenv("CACHE_URL", "redis://localhost:6379/0")), ttl)
+        else:
+            self.backend = None
+        app.extensions["response_cache"] = self
+
+    def generation(self, namespace, item_id=None):
+        key = f"gen:{namespace}" if item_id is None else f"gen:{namespace}:{item_id}"
+        value = self.backend.get(key)
+        if value is None:
+            # a lost marker must never bring back an older generation, so they are timestamps
+            value = time.time_ns()
+            self.backend.set(key, value, ttl=0)
+        return int(value)
+
+    def invalidate(self, namespace, item_id=None):
+        if self.backend is None:
+            return
+        self.backend.set(f"gen:{namespace}", time.time_ns(), ttl=0)
+        if item_id is not None:
+            self.backend.set(f"gen:{namespace}:{item_id}", time.time_ns(), ttl=0)
+
+    def cached(self, namespace, item_arg=None):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.backend is None or wants_stream(request):
+                    return view(*args, **kwargs)
+
+                item_id = kwargs.get(item_arg)
+                encoding = negotiate(request)
+                # the table versions @conditional read: a write served by another worker doesn't
+                # invalidate the memory backend of this one, but it moves them and the key with them
+                versions = ",".join(f"{name}={version}" for name, version in g.get("table_versions", ()))
+                if item_id is None:
+                    key = f"{namespace}:{self.generation(namespace)}:{versions}:" \
+                        f"{request.query_string.decode()}:{encoding}"
+                else:
+                    key = f"{namespace}:{item_id}:{self.generation(namespace, item_id)}:{versions}:" \
+                        f"{request.query_string.decode()}:{encoding}"
+
+                # entries are "<content encoding>\n<body>", compressed once when they are stored
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    applied, body = entry.split(b"\n", 1)
+                    response = Response(body, mimetype="application/json")
+                    if applied != b"identity":
+                        response.headers["Content-Encoding"] = applied.decode()
+                    response.vary.add("Accept-Encoding")
+                    response.headers["X-Cache"] = "HIT"
+                    return response
+
+                self.misses += 1
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    body, applied = compress_body(response.get_data(), encoding)
+                    if applied is not None:
+                        response.set_data(body)
+                        response.headers["Content-Encoding"] = applied
+                    response.vary.add("Accept-Encoding")
+                    # a replica can still miss the write that bumped the generation, so what it
+                    # served is only kept as long as the read-your-writes window
+                    ttl = READ_YOUR_WRITES_SECONDS if g.get("replica_engine") is not None else None
+                    self.backend.set(key, (applied or "identity").encode() + b"\n" + body, ttl=ttl)
+                response.headers["X-Cache"] = "MISS"
+                return response
+            return wrapper
+        return decorator
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions if self.backend is not None else 0,
+            "entries": len(self.backend) if self.backend is not None else 0
+        }
+
+
+cache = ResponseCache()
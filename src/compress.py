@@ -0,0 +1,143 @@
+"""
+Compression of the JSON (and NDJSON) responses, negotiated with Accept-Encoding.
+
+- gzip always works (zlib), br needs `pipenv install brotli` and zstd `pipenv install zstandard`
+- COMPRESSION_ENCODINGS (zstd,br,gzip) is the order of preference when the client takes several
+- bodies under COMPRESSION_MIN_SIZE bytes (1024) are sent as they are
+- GZIP_LEVEL (6), BROTLI_LEVEL (4) and ZSTD_LEVEL (3) trade CPU for bytes,
+  see benchmarks/bench_compression.py
+- COMPRESSION=off disables it, when a proxy in front already compresses
+
+Streamed responses are compressed chunk by chunk, every chunk is flushed so the client keeps
+getting rows as they are read. The response cache stores bodies already compressed (see cache.py).
+"""
+import os
+import zlib
+from flask import request
+from utils import NDJSON_MIMETYPE, env_flag
+
+COMPRESSIBLE = {"application/json", NDJSON_MIMETYPE, "text/html", "text/plain"}
+MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+
+
+class Gzip:
+    name = "gzip"
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def stream(self, chunks):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+class Brotli:
+    name = "br"
+
+    def __init__(self, level):
+        import brotli
+        self.brotli = brotli
+        self.level = level
+
+    def compress(self, data):
+        return self.brotli.compress(data, quality=self.level)
+
+    def stream(self, chunks):
+        compressor = self.brotli.Compressor(quality=self.level)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+
+
+class Zstd:
+    name = "zstd"
+
+    def __init__(self, level):
+        import zstandard
+        self.zstandard = zstandard
+        self.level = level
+
+    def compress(self, data):
+        return self.zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def stream(self, chunks):
+        compressor = self.zstandard.ZstdCompressor(level=self.level).compressobj()
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(self.zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        yield compressor.flush()
+
+
+def load_encoders():
+    encoders = {}
+    for name in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(","):
+        try:
+            if name == "gzip":
+                encoders[name] = Gzip(int(os.getenv("GZIP_LEVEL", 6)))
+            elif name == "br":
+                encoders[name] = Brotli(int(os.getenv("BROTLI_LEVEL", 4)))
+            elif name == "zstd":
+                encoders[name] = Zstd(int(os.getenv("ZSTD_LEVEL", 3)))
+        except ImportError:
+            continue  # the library isn't installed, the next encoding in the list is used
+    return encoders
+
+
+ENCODERS = load_encoders() if env_flag("COMPRESSION", True) else {}
+
+
+def negotiate(request):
+    # the first encoding of our preference list the client accepts, None to send it as it is
+    for name in ENCODERS:
+        if request.accept_encodings[name]:
+            return name
+    return None
+
+
+def compressible(response):
+    return response.mimetype in COMPRESSIBLE and response.status_code == 200 \
+        and "Content-Encoding" not in response.headers
+
+
+def compress_body(body, encoding):
+    # returns the encoding actually applied, small bodies aren't worth the CPU
+    if encoding is None or len(body) < MIN_SIZE:
+        return body, None
+    return ENCODERS[encoding].compress(body), encoding
+
+
+def _encoded(chunks):
+    for chunk in chunks:
+        if chunk:
+            yield chunk.encode() if isinstance(chunk, str) else chunk
+
+
+def setup_compression(app):
+    if not ENCODERS:
+        return
+
+    @app.after_request
+    def compress_response(response):
+        if not compressible(response):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate(request)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = ENCODERS[encoding].stream(_encoded(response.response))
+            response.headers.pop("Content-Length", None)
+            response.headers["Content-Encoding"] = encoding
+            return response
+
+        body, applied = compress_body(response.get_data(), encoding)
+        if applied is not None:
+            response.set_data(body)
+            response.headers["Content-Encoding"] = applied
+        return response
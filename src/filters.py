@@ -0,0 +1,83 @@
+"""
+Query string filters, sorting and name search translated to SQL, only on the fields each model allow-lists:
+
+    ?climate=arid&terrain=desert         equality (FILTER_FIELDS)
+    ?population__gte=1000&mass__lt=80    ranges: __gt, __gte, __lt, __lte (RANGE_FIELDS)
+    ?name__prefix=Lu                     prefix on the name, served by the unique index on name
+    ?q=sky walker                        name search: FTS5 on SQLite, trigram index on Postgres
+    ?sort=-population,name               ascending or descending (-) on SORT_FIELDS
+"""
+import sys
+from sqlalchemy import Integer, column, text
+from models import db
+from utils import APIException
+
+RANGE_OPERATORS = {
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+}
+RESERVED_ARGS = {"fields", "limit", "after", "stream", "sort", "q", "include"}
+
+
+def filter_and_sort(query, model, args):
+    """Returns the filtered query and the order as a list of (column, descending)"""
+    for arg, value in args.items():
+        if arg in RESERVED_ARGS:
+            continue
+        field, _, operator = arg.partition("__")
+        if not operator and field in model.FILTER_FIELDS:
+            query = query.filter(getattr(model, field) == _coerce(model, field, value))
+        elif operator in RANGE_OPERATORS and field in model.RANGE_FIELDS:
+            query = query.filter(RANGE_OPERATORS[operator](getattr(model, field), _coerce(model, field, value)))
+        elif field == "name" and operator == "prefix" and value:
+            query = query.filter(*_prefix(model.name, value))
+        else:
+            raise APIException(f"Unknown filter {arg}", status_code=400)
+
+    if args.get("q", "").strip():
+        query = query.filter(_search(model, args["q"]))
+
+    order = []
+    for field in args.get("sort", "").split(","):
+        field = field.strip()
+        if not field:
+            continue
+        descending = field.startswith("-")
+        field = field.lstrip("-")
+        if field not in model.SORT_FIELDS:
+            raise APIException(f"Can't sort by {field}", status_code=400)
+        order.append((getattr(model, field), descending))
+    return query, order
+
+
+def _coerce(model, field, value):
+    if model.__table__.columns[field].type.python_type is int:
+        try:
+            return int(value)
+        except ValueError:
+            raise APIException(f"{field} must be an integer", status_code=400)
+    return value
+
+
+def _prefix(column, prefix):
+    # a range on the btree index works on every database, the LIKE keeps it exact under any collation
+    if prefix[-1] == chr(sys.maxunicode):
+        # no character comes after it, the range has no upper bound
+        return column >= prefix, column.startswith(prefix, autoescape=True)
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return column >= prefix, column < upper, column.startswith(prefix, autoescape=True)
+
+
+def _search(model, terms):
+    table = model.__tablename__
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "sqlite":
+        # every word as a quoted prefix token, so the user input can't use the FTS5 query syntax
+        match = " ".join('"' + word.replace('"', '""') + '"*' for word in terms.split())
+        matches = text(f"SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH :match")
+        return model.id.in_(matches.bindparams(match=match).columns(column("rowid", Integer)))
+    # on Postgres ix_<table>_name_trgm (gin_trgm_ops) serves ILIKE '%...%', elsewhere it's a scan
+    return model.name.ilike("%" + terms.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%",
+                            escape="\\")
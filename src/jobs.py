@@ -0,0 +1,208 @@
+"""
+Background jobs: a queue table (models.Job) the API writes to and the workers of worker.py read.
+
+The long writes answer 202 with the job, its status is at GET /jobs/<id>:
+- import: the items of POST /people/import and /planets/import, written like the bulk endpoints
+- delete_user: the favorites of a user in batches of JOB_BATCH_SIZE (1000), then the user
+- warm_cache: GETs the paths of POST /cache/warm so the response cache has them
+
+A worker takes the oldest due job with SELECT ... FOR UPDATE SKIP LOCKED (Postgres) and an
+UPDATE that only succeeds if the job is still due, so two workers never run the same job. It then
+holds a lease of JOB_TIMEOUT_SECONDS (600): a job still running after that belongs to a worker
+that died, another one runs it again. A failed job is retried JOB_MAX_ATTEMPTS (3) times in all,
+JOB_RETRY_SECONDS (30) apart and twice longer every time, a job whose last lease ran out is failed.
+Jobs run at least once, each of them is safe to run again.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app, jsonify, url_for
+from sqlalchemy import delete, func, select, update
+from models import db, FAVORITE_COUNTERS, Job, People, Planets, User, bump_version, count_favorites
+from bulk import bulk_create
+from cache import cache
+
+logger = logging.getLogger(__name__)
+
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", 1000))
+JOB_TIMEOUT_SECONDS = int(os.getenv("JOB_TIMEOUT_SECONDS", 600))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_SECONDS = int(os.getenv("JOB_RETRY_SECONDS", 30))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 1))
+# done and failed jobs are deleted after this long
+JOB_RETENTION_HOURS = int(os.getenv("JOB_RETENTION_HOURS", 168))
+
+# kind -> function(payload) returning the result stored on the job
+JOBS = {}
+IMPORT_MODELS = {"people": People, "planets": Planets}
+# first pages of the cached lists, what POST /cache/warm warms without a body
+WARM_PATHS = ("/people", "/planets")
+
+
+def job(kind):
+    def decorator(function):
+        JOBS[kind] = function
+        return function
+    return decorator
+
+
+def _now():
+    # naive UTC, what DateTime columns store on every database
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def enqueue(kind, payload):
+    if kind not in JOBS:
+        raise ValueError(f"Unknown job {kind}")
+    now = _now()
+    queued = Job(kind=kind, payload=payload, status="queued", attempts=0, run_after=now, created_at=now)
+    db.session.add(queued)
+    db.session.commit()
+    return queued
+
+
+def accepted(queued):
+    # 202 with the job, the client polls the Location for the result
+    response = jsonify(queued.serialize())
+    response.headers["Location"] = url_for("api.get_job", job_id=queued.id)
+    return response, 202
+
+
+def job_stats():
+    counts = dict(db.session.execute(select(Job.status, func.count()).group_by(Job.status)).all())
+    due = db.session.scalar(select(func.count()).select_from(Job).where(
+        Job.status == "queued", Job.run_after <= _now()))
+    return {**{status: counts.get(status, 0) for status in ("queued", "running", "done", "failed")}, "due": due}
+
+
+def claim(worker):
+    """Takes the oldest due job for worker and starts its lease, None when no job is due"""
+    while True:
+        now = _now()
+        due = (Job.status.in_(("queued", "running")), Job.run_after <= now)
+        row = db.session.execute(
+            select(Job.id, Job.attempts).where(*due).order_by(Job.run_after, Job.id).limit(1)
+            .with_for_update(skip_locked=True)).first()
+        if row is None:
+            db.session.rollback()
+            return None
+        job_id, attempts = row
+        # without SKIP LOCKED (SQLite) two workers can pick the same id, the second UPDATE matches nothing
+        if attempts >= JOB_MAX_ATTEMPTS:
+            # a lease that ran out on the last attempt: the job took its worker down every time
+            db.session.execute(update(Job).where(Job.id == job_id, *due).values(
+                status="failed", finished_at=now,
+                error=f"Lease expired after {attempts} attempts, the worker running it died"))
+            db.session.commit()
+            continue
+        taken = db.session.execute(update(Job).where(Job.id == job_id, *due).values(
+            status="running", attempts=Job.attempts + 1, worker=worker, started_at=now,
+            run_after=now + timedelta(seconds=JOB_TIMEOUT_SECONDS))).rowcount
+        db.session.commit()
+        if taken:
+            return db.session.get(Job, job_id)
+
+
+def run(claimed):
+    job_id, attempts, kind = claimed.id, claimed.attempts, claimed.kind
+    # a worker that lost its lease doesn't overwrite what the next attempt writes
+    this_attempt = update(Job).where(Job.id == job_id, Job.attempts == attempts)
+    try:
+        result = JOBS[kind](claimed.payload)
+    except Exception as error:
+        db.session.rollback()
+        logger.exception("job %s (%s) failed, attempt %s", job_id, kind, attempts)
+        if attempts >= JOB_MAX_ATTEMPTS:
+            values = {"status": "failed", "finished_at": _now()}
+        else:
+            retry = JOB_RETRY_SECONDS * 2 ** (attempts - 1)
+            values = {"status": "queued", "run_after": _now() + timedelta(seconds=retry)}
+        db.session.execute(this_attempt.values(error=f"{type(error).__name__}: {error}", **values))
+    else:
+        db.session.execute(this_attempt.values(status="done", result=result, error=None, finished_at=_now()))
+    db.session.commit()
+
+
+def prune():
+    before = _now() - timedelta(hours=JOB_RETENTION_HOURS)
+    pruned = db.session.execute(delete(Job).where(
+        Job.status.in_(("done", "failed")), Job.finished_at < before)).rowcount
+    db.session.commit()
+    return pruned
+
+
+def work(app, concurrency, stop=None, burst=False):
+    """
+    Runs the jobs in concurrency threads until stop is set, or with burst until no job is due.
+    Every thread holds a database connection while its job runs.
+    """
+    stop = stop or threading.Event()
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    pruned_at = [0.0]
+
+    def loop(index):
+        while not stop.is_set():
+            with app.app_context():
+                try:
+                    claimed = claim(f"{name}:{index}")
+                    if claimed is not None:
+                        run(claimed)
+                        continue
+                    if index == 0 and time.monotonic() - pruned_at[0] > 3600:
+                        pruned_at[0] = time.monotonic()
+                        prune()
+                except Exception:
+                    # the database went away, the thread waits and tries again
+                    logger.exception("job worker %s", index)
+            if burst:
+                return
+            stop.wait(JOB_POLL_SECONDS)
+
+    threads = [threading.Thread(target=loop, args=(index,), name=f"job-worker-{index}", daemon=True)
+               for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        # with a timeout, so the main thread still gets the signals
+        while thread.is_alive():
+            thread.join(1)
+
+
+@job("import")
+def import_rows(payload):
+    table = payload["table"]
+    return bulk_create(IMPORT_MODELS[table], payload["items"], on_commit=lambda rows: cache.invalidate(table))
+
+
+@job("delete_user")
+def delete_user(payload):
+    # the favorites go in batches, each one a short transaction that also fixes the counters
+    user_id = payload["user_id"]
+    favorites = 0
+    for model, (_, column) in FAVORITE_COUNTERS.items():
+        while True:
+            rows = db.session.execute(select(model.id, getattr(model, column)).where(model.user_id == user_id)
+                                      .order_by(model.id).limit(JOB_BATCH_SIZE)).all()
+            if not rows:
+                break
+            count_favorites(model, [target_id for _, target_id in rows], -1)
+            db.session.execute(delete(model).where(model.id.in_([favorite_id for favorite_id, _ in rows])))
+            bump_version(model.__tablename__)
+            db.session.commit()
+            favorites += len(rows)
+    deleted = db.session.execute(delete(User).where(User.id == user_id)).rowcount
+    if deleted:
+        bump_version("user")
+    db.session.commit()
+    return {"user_deleted": bool(deleted), "favorites_deleted": favorites}
+
+
+@job("warm_cache")
+def warm_cache(payload):
+    # through the views, so the entries are exactly what they would cache. The web workers only
+    # see them with a shared backend (CACHE_BACKEND=redis)
+    client = current_app.test_client()
+    return {"statuses": {path: client.get(path).status_code for path in payload["paths"]}}
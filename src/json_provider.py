@@ -0,0 +1,61 @@
+"""
+JSON encoding of the API, picked per deployment with the JSON_PROVIDER env variable:
+- auto (default): orjson when it's installed (`pipenv install orjson`), the stdlib otherwise
+- orjson: fail at startup when orjson is missing
+- stdlib: Flask's own provider
+
+Both produce the same bytes: sorted keys, ASCII only output and compact separators.
+orjson always writes compact UTF-8, so calls asking for another layout (indent in debug mode,
+the default ", " separators), values it can't encode (ints over 64 bits) and payloads with
+non-ASCII characters go through the stdlib encoder.
+"""
+import logging
+import os
+from flask.json.provider import DefaultJSONProvider
+
+logger = logging.getLogger(__name__)
+
+COMPACT = (",", ":")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+
+    def __init__(self, app):
+        super().__init__(app)
+        import orjson
+        self.orjson = orjson
+        # dates and dataclasses go through Flask's default() like with the stdlib encoder
+        self.options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.get("separators") == COMPACT and kwargs.keys() <= {"separators"}:
+            options = self.options | self.orjson.OPT_SORT_KEYS if self.sort_keys else self.options
+            try:
+                data = self.orjson.dumps(obj, default=self.default, option=options)
+            except TypeError:
+                data = None
+            if data is not None and (data.isascii() or not self.ensure_ascii):
+                return data.decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        try:
+            return self.orjson.loads(s)
+        except self.orjson.JSONDecodeError:
+            # NaN, huge ints and the like: the stdlib accepts them or raises its usual error
+            return super().loads(s)
+
+
+def setup_json(app):
+    # before setup_profiling, which wraps whatever provider is in place
+    kind = os.getenv("JSON_PROVIDER", "auto")
+    if kind == "stdlib":
+        return
+    try:
+        app.json = OrjsonProvider(app)
+    except ImportError:
+        if kind == "orjson":
+            raise
+        logger.info("orjson is not installed, JSON is encoded with the stdlib")
@@ -0,0 +1,81 @@
+"""
+Prometheus metrics on GET /metrics, prometheus-client is in the Pipfile.
+
+Every route is measured from before_request/after_request hooks labelled with the route rule
+(like /people/<int:people_id>), so the views and their responses stay untouched.
+
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR to an empty directory: every worker writes its
+samples to its own mmap'd files there without locks between processes, and /metrics adds up
+the files of all the workers.
+"""
+import logging
+import os
+import time
+from flask import Response, g, request
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 10)
+
+# created once per process on the global registry, create_app() can run more than once
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+except ImportError:
+    prometheus_client = None
+else:
+    REQUESTS_TOTAL = Counter("http_requests_total", "Requests served",
+                             ["method", "endpoint", "status"])
+    REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Request latency",
+                                ["method", "endpoint"], buckets=LATENCY_BUCKETS)
+    IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being served", multiprocess_mode="livesum")
+    POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections in use", multiprocess_mode="livesum")
+    POOL_SIZE = Gauge("db_pool_size", "Connections kept by the pools", multiprocess_mode="livesum")
+    # the cache counters live in each worker, the gauges mirror them and get added across workers
+    CACHE_HITS = Gauge("api_cache_hits", "Response cache hits", multiprocess_mode="livesum")
+    CACHE_MISSES = Gauge("api_cache_misses", "Response cache misses", multiprocess_mode="livesum")
+
+
+def setup_metrics(app, db, cache):
+    if prometheus_client is None:
+        logger.warning("prometheus-client is not installed (run `pipenv install`), /metrics is disabled")
+        return
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_in_flight = True
+        IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - started)
+        REQUESTS_TOTAL.labels(request.method, endpoint, response.status_code).inc()
+
+        stats = cache.stats()
+        CACHE_HITS.set(stats["hits"])
+        CACHE_MISSES.set(stats["misses"])
+        pool = db.engine.pool
+        if hasattr(pool, "checkedout"):
+            POOL_CHECKED_OUT.set(pool.checkedout())
+            POOL_SIZE.set(pool.size())
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(error):
+        if g.pop("metrics_in_flight", False):
+            IN_FLIGHT.dec()
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            from prometheus_client import CollectorRegistry, multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return Response(prometheus_client.generate_latest(registry), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
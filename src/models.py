@@ -1,6 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
+from collections import Counter
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import DDL, bindparam, event, func, literal, select, union_all
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class User(db.Model):
     __tablename__ = 'user'
@@ -14,109 +18,366 @@ class User(db.Model):
     def __repr__(self):
         return '<User %r>' % self.first_name + ' ' + self.last_name
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "email": self.email,
-            "full_name": self.first_name + ' ' + self.last_name
-            # do not serialize the password, its a security breach
-        }
+    # serialized key -> columns it reads, used to load only what ?fields= asks for
+    SERIALIZED_FIELDS = {"id": ("id",), "email": ("email",), "full_name": ("first_name", "last_name")}
+
+    def serialize(self, fields=None):
+        # only the requested keys are built, the columns of the others may not even be loaded
+        fields = fields or self.SERIALIZED_FIELDS
+        response = {}
+        if "id" in fields:
+            response["id"] = self.id
+        if "email" in fields:
+            response["email"] = self.email
+        if "full_name" in fields:
+            response["full_name"] = self.first_name + ' ' + self.last_name
+        # do not serialize the password, its a security breach
+        return response
     
 
 class People(db.Model):
     __tablename__ = 'people'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250), nullable=False, unique=True)
-    gender = db.Column(db.String(100), nullable=False)
-    height = db.Column(db.Integer, nullable=False)
-    mass = db.Column(db.Integer, nullable=False)
-    hair_color = db.Column(db.String(100), nullable=False)
+    gender = db.Column(db.String(100), nullable=False, index=True)
+    height = db.Column(db.Integer, nullable=False, index=True)
+    mass = db.Column(db.Integer, nullable=False, index=True)
+    hair_color = db.Column(db.String(100), nullable=False, index=True)
     skin_color = db.Column(db.String(150), nullable=False)
-    eye_color = db.Column(db.String(250), nullable=False)
+    eye_color = db.Column(db.String(250), nullable=False, index=True)
     birth_year = db.Column(db.String(250), nullable=False)
+    # kept by the favorite writes in their transaction, see count_favorites()
+    favorites_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    __table_args__ = (db.Index('ix_people_favorites_count_id', 'favorites_count', 'id'),)
 
     def __repr__(self):
         return '<People %r>' % self.name
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "gender": self.gender,
-            "height": self.height,
-            "mass": self.mass,
-            "hair_color": self.hair_color,
-            "skin_color": self.skin_color,
-            "eye_color": self.eye_color,
-            "birth_year": self.birth_year
-        }
+    SERIALIZED_FIELDS = {field: (field,) for field in (
+        "id", "name", "gender", "height", "mass", "hair_color", "skin_color", "eye_color", "birth_year")}
+    # allow-lists of the query string filters and sorting, every one of them has an index
+    FILTER_FIELDS = ("gender", "eye_color", "hair_color")
+    RANGE_FIELDS = ("height", "mass")
+    # not favorites_count: the favorite writes don't bump "people", a cached or 304'd list would keep
+    # the old order. /people/top ranks by it, its ETag follows the favorites
+    SORT_FIELDS = ("id", "name", "height", "mass")
+    # columns the API computes, never written from a request body
+    COMPUTED_FIELDS = ("favorites_count",)
+
+    def serialize(self, fields=None):
+        return {field: getattr(self, field) for field in fields or self.SERIALIZED_FIELDS}
 
 
 class Planets(db.Model):
     __tablename__ = 'planets'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250), nullable=False, unique=True)
-    diameter = db.Column(db.Integer, nullable=False)
+    diameter = db.Column(db.Integer, nullable=False, index=True)
     rotation_period = db.Column(db.Integer, nullable=False)
     orbital_period = db.Column(db.Integer, nullable=False)
     gravity = db.Column(db.String(100), nullable=False)
-    population = db.Column(db.Integer, nullable=False)
-    climate = db.Column(db.String(250), nullable=False)
-    terrain = db.Column(db.String(250), nullable=False)
+    population = db.Column(db.Integer, nullable=False, index=True)
+    climate = db.Column(db.String(250), nullable=False, index=True)
+    terrain = db.Column(db.String(250), nullable=False, index=True)
     surface_water = db.Column(db.Integer, nullable=False)
+    favorites_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    __table_args__ = (db.Index('ix_planets_favorites_count_id', 'favorites_count', 'id'),)
 
     def __repr__(self):
         return '<Planets %r>' % self.name
 
-    def serialize(self):
-        return {
-            "id" : self.id,
-            "name" : self.name,
-            "diameter" : self.diameter,
-            "rotation_period" : self.rotation_period,
-            "orbital_period" : self.orbital_period,
-            "gravity" : self.gravity,
-            "population" : self.population,
-            "climate" : self.climate,
-            "terrain" : self.terrain,
-            "surface_water" : self.surface_water
-        }
+    SERIALIZED_FIELDS = {field: (field,) for field in (
+        "id", "name", "diameter", "rotation_period", "orbital_period", "gravity", "population",
+        "climate", "terrain", "surface_water")}
+    FILTER_FIELDS = ("climate", "terrain")
+    RANGE_FIELDS = ("population", "diameter")
+    SORT_FIELDS = ("id", "name", "population", "diameter")
+    COMPUTED_FIELDS = ("favorites_count",)
+
+    def serialize(self, fields=None):
+        return {field: getattr(self, field) for field in fields or self.SERIALIZED_FIELDS}
+
+
+# name search (see filters.py): FTS5 tables kept in sync by triggers on SQLite, trigram indexes on Postgres.
+# They are created with the tables by db.create_all(), the migrations create them for existing databases
+event.listen(db.metadata, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+for searchable in (People.__table__, Planets.__table__):
+    name = searchable.name
+    event.listen(searchable, "after_create", DDL(
+        f"CREATE INDEX ix_{name}_name_trgm ON {name} USING gin (name gin_trgm_ops)").execute_if(dialect="postgresql"))
+    for statement in (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {name}_fts USING fts5(name, content='{name}', content_rowid='id')",
+        f"INSERT INTO {name}_fts({name}_fts) VALUES ('rebuild')",
+        f"CREATE TRIGGER {name}_fts_insert AFTER INSERT ON {name} BEGIN "
+        f"INSERT INTO {name}_fts(rowid, name) VALUES (new.id, new.name); END",
+        f"CREATE TRIGGER {name}_fts_delete AFTER DELETE ON {name} BEGIN "
+        f"INSERT INTO {name}_fts({name}_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+        f"CREATE TRIGGER {name}_fts_update AFTER UPDATE OF name ON {name} BEGIN "
+        f"INSERT INTO {name}_fts({name}_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+        f"INSERT INTO {name}_fts(rowid, name) VALUES (new.id, new.name); END",
+    ):
+        event.listen(searchable, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+    event.listen(searchable, "after_drop",
+                 DDL(f"DROP TABLE IF EXISTS {name}_fts").execute_if(dialect="sqlite"))
 
 
 class FavoritePlanets(db.Model):
     __tablename__ = 'favorites_planets'
+    __table_args__ = (
+        # one favorite per user and planet, it also serves the per user lookups without reading the table
+        db.Index('ix_favorites_planets_user_id_planet_id', 'user_id', 'planet_id',
+                 unique=True, postgresql_include=['id']),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'), unique=True)
+    planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'), index=True)
     user = db.relationship(User, backref="favorites_planets")
     planets = db.relationship(Planets)
 
     def __repr__(self):
-        return f"${self.user.first_name} likes ${self.planet.name}"
+        return f"${self.user.first_name} likes ${self.planets.name}"
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "user": self.user.first_name,
-            "planet": self.planets.name
-        }
+    # favorites are read joined with their user and planet, fields only trims the output
+    SERIALIZED_FIELDS = {"id": (), "user": (), "planet": ()}
+
+    def serialize(self, fields=None):
+        fields = fields or self.SERIALIZED_FIELDS
+        response = {}
+        if "id" in fields:
+            response["id"] = self.id
+        if "user" in fields:
+            response["user"] = self.user.first_name
+        if "planet" in fields:
+            response["planet"] = self.planets.name
+        return response
+
+    @staticmethod
+    def serialize_row(row, user_name):
+        # same output as serialize() from a row of favorites_query(), without loading any object
+        return {"id": row.favorite_id, "user": user_name, "planet": row.name}
 
 
 class FavoritePeople(db.Model):
     __tablename__ = 'favorites_people'
+    __table_args__ = (
+        # one favorite per user and character, it also serves the per user lookups without reading the table
+        db.Index('ix_favorites_people_user_id_people_id', 'user_id', 'people_id',
+                 unique=True, postgresql_include=['id']),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    people_id = db.Column(db.Integer, db.ForeignKey('people.id'), unique=True)
+    people_id = db.Column(db.Integer, db.ForeignKey('people.id'), index=True)
     user = db.relationship(User, backref="favorites_people")
     people = db.relationship(People)
 
     def __repr__(self):
         return f"${self.user.first_name} likes ${self.people.name}"
 
+    SERIALIZED_FIELDS = {"id": (), "user": (), "people": (), "people_image": ()}
+
+    def serialize(self, fields=None):
+        fields = fields or self.SERIALIZED_FIELDS
+        response = {}
+        if "id" in fields:
+            response["id"] = self.id
+        if "user" in fields:
+            response["user"] = self.user.first_name
+        if "people" in fields:
+            response["people"] = self.people.name
+        if "people_image" in fields:
+            response["people_image"] = f"https://starwars-visualguide.com/assets/img/characters/{self.people_id}.jpg"
+        return response
+
+    @staticmethod
+    def serialize_row(row, user_name):
+        return {"id": row.favorite_id, "user": user_name, "people": row.name,
+                "people_image": f"https://starwars-visualguide.com/assets/img/characters/{row.target_id}.jpg"}
+
+# favorites table -> the model whose favorites_count it feeds and the column pointing to it
+FAVORITE_COUNTERS = {FavoritePlanets: (Planets, "planet_id"), FavoritePeople: (People, "people_id")}
+
+
+def count_favorites(model, target_ids, delta):
+    """
+    Adds delta to favorites_count of every planet or character in target_ids (once per
+    occurrence), in the caller's transaction so the counters commit or roll back with the favorites.
+    Does nothing for the other models, the bulk writes call it for every table.
+    Ids that aren't integers are skipped: they match no row (SQLite stores what it is given, a
+    favorite written around the API can point to "x"), there is no counter to move.
+    """
+    if model not in FAVORITE_COUNTERS:
+        return
+    target = FAVORITE_COUNTERS[model][0].__table__
+    deltas = Counter(target_id for target_id in target_ids if type(target_id) is int)
+    if not deltas:
+        return
+    # in id order, so two transactions touching the same rows lock them in the same order
+    db.session.execute(
+        target.update().where(target.c.id == bindparam("target_id"))
+        .values(favorites_count=target.c.favorites_count + bindparam("delta")),
+        [{"target_id": target_id, "delta": count * delta} for target_id, count in sorted(deltas.items())])
+
+
+def reconcile_favorite_counts(batch_size=10000):
+    """
+    Recounts the favorites of every planet and character, batch_size rows per transaction, and
+    returns how many counters were wrong. A counter only drifts when favorites are written
+    around the API (SQL by hand, an admin edit moving a favorite to another planet).
+    """
+    fixed = 0
+    for model, (target_model, column) in FAVORITE_COUNTERS.items():
+        target = target_model.__table__
+        actual = select(func.count()).where(getattr(model, column) == target.c.id).scalar_subquery()
+        last_id = db.session.scalar(select(func.max(target.c.id))) or 0
+        for start in range(0, last_id, batch_size):
+            fixed += db.session.execute(
+                target.update().where(target.c.id > start, target.c.id <= start + batch_size,
+                                      target.c.favorites_count != actual)
+                .values(favorites_count=actual)).rowcount
+            db.session.commit()
+    if fixed:
+        bump_version("people", "planets")
+        db.session.commit()
+    return fixed
+
+
+def favorites_query(user_id, include):
+    """
+    One UNION ALL statement with the favorites of a user and the names of their planets and people,
+    rows are (kind, favorite_id, target_id, name) where kind is the User backref they belong to
+    """
+    branches = {
+        "favorites_planets": select(literal("favorites_planets").label("kind"), FavoritePlanets.id.label("favorite_id"),
+                                    FavoritePlanets.planet_id.label("target_id"), Planets.name)
+        .join(Planets, FavoritePlanets.planet_id == Planets.id).where(FavoritePlanets.user_id == user_id),
+        "favorites_people": select(literal("favorites_people").label("kind"), FavoritePeople.id.label("favorite_id"),
+                                   FavoritePeople.people_id.label("target_id"), People.name)
+        .join(People, FavoritePeople.people_id == People.id).where(FavoritePeople.user_id == user_id),
+    }
+    return union_all(*(branches[kind] for kind in include)).order_by("favorite_id")
+
+class TableVersion(db.Model):
+    # one row per table, bumped by every write, it's what the ETags are built from
+    __tablename__ = 'table_versions'
+    name = db.Column(db.String(120), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<TableVersion %r %r>' % (self.name, self.version)
+
+
+def bump_version(*tables):
+    # runs inside the caller's transaction so the marker changes together with the rows
+    for name in tables:
+        updated = db.session.execute(
+            db.update(TableVersion).where(TableVersion.name == name).values(version=TableVersion.version + 1))
+        if updated.rowcount == 0:
+            db.session.add(TableVersion(name=name, version=1))
+
+
+def get_versions(tables):
+    rows = db.session.execute(
+        db.select(TableVersion.name, TableVersion.version).where(TableVersion.name.in_(tables)))
+    versions = dict(rows.all())
+    return [(name, versions.get(name, 0)) for name in tables]
+
+
+class Job(db.Model):
+    # the background job queue, see jobs.py
+    __tablename__ = 'jobs'
+    # what the workers look for: the due jobs, queued or with an expired lease
+    __table_args__ = (db.Index('ix_jobs_status_run_after', 'status', 'run_after'),)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    # queued, running, done or failed
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # queued: when it can run, running: when the lease of its worker ends
+    run_after = db.Column(db.DateTime, nullable=False)
+    worker = db.Column(db.String(120))
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<Job %r %r>' % (self.id, self.kind)
+
     def serialize(self):
-        return {
-            "id": self.id,
-            "user": self.user.first_name,
-            "people": self.people.name,
-            "people_image": f"https://starwars-visualguide.com/assets/img/characters/{self.people_id}.jpg"
-        }
\ No newline at end of file
+        # the payload stays out, an import carries every item
+        timestamps = {name: value.isoformat() + "Z" if value is not None else None for name, value in (
+            ("created_at", self.created_at), ("started_at", self.started_at), ("finished_at", self.finished_at))}
+        return {"id": self.id, "kind": self.kind, "status": self.status, "attempts": self.attempts,
+                "result": self.result, "error": self.error, **timestamps}
+
+
+def _insert(model):
+    # the dialect INSERT with ON CONFLICT, None on the databases without it
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(model)
+
+
+def insert_or_get(model, values, keys):
+    """
+    INSERT ... ON CONFLICT (keys) DO NOTHING RETURNING id, returns (id, created).
+    A duplicate (a retried request, or the same one sent twice at once) gets the id of the row
+    already there, nothing raises and the transaction goes on.
+    """
+    statement = _insert(model)
+    if statement is None:
+        try:
+            with db.session.begin_nested():
+                row = model(**values)
+                db.session.add(row)
+            return row.id, True
+        except IntegrityError:
+            pass
+    else:
+        row_id = db.session.scalar(
+            statement.values(values).on_conflict_do_nothing(index_elements=keys).returning(model.id))
+        if row_id is not None:
+            return row_id, True
+    return db.session.scalar(select(model.id).filter_by(**{key: values[key] for key in keys})), False
+
+
+def upsert(model, values, keys):
+    """
+    INSERT ... ON CONFLICT (keys) DO UPDATE SET the other columns, returns the row as written
+    in the same round trip
+    """
+    statement = _insert(model)
+    if statement is None:
+        row = model.query.filter_by(**{key: values[key] for key in keys}).first() or model()
+        for field, value in values.items():
+            setattr(row, field, value)
+        db.session.add(row)
+        db.session.flush()
+        return row
+    statement = statement.values(values)
+    statement = statement.on_conflict_do_update(
+        index_elements=keys, set_={field: statement.excluded[field] for field in values if field not in keys})
+    return db.session.scalars(statement.returning(model), execution_options={"populate_existing": True}).one()
+
+
+def update_row(model, row_id, values):
+    """
+    UPDATE ... WHERE id = ... RETURNING the whole row, without loading it first.
+    None when there is no row with that id
+    """
+    statement = db.update(model).where(model.id == row_id).values(values)
+    if not db.session.get_bind().dialect.update_returning:
+        # MySQL: the UPDATE, then the row
+        if db.session.execute(statement).rowcount == 0:
+            return None
+        return db.session.get(model, row_id, populate_existing=True)
+    return db.session.scalars(statement.returning(model), execution_options={"populate_existing": True}).one_or_none()
+
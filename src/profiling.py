@@ -0,0 +1,147 @@
+"""
+Opt-in request profiling, enabled with PROFILE_REQUESTS=1.
+
+For every request it measures the wall time, the number and total time of the SQL statements and
+the time spent encoding JSON. They are sent back in a Server-Timing header and logged as one JSON
+line on the "api.profile" logger.
+
+Requests slower than PROFILE_SLOW_MS (500) are also sampled every PROFILE_SAMPLE_INTERVAL_MS (5)
+while they run, their stacks are written to PROFILE_DIR (/tmp/profiles) in the collapsed format
+that flamegraph.pl and speedscope read.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from utils import env_flag
+
+logger = logging.getLogger("api.profile")
+
+
+class StackSampler:
+    """Background thread sampling the stacks of the threads that are serving a request"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.active = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, thread_id):
+        stacks = Counter()
+        with self.lock:
+            self.active[thread_id] = stacks
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self.thread.start()
+        return stacks
+
+    def stop(self, thread_id):
+        with self.lock:
+            self.active.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, stacks in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_collapse(frame)] += 1
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _on_before_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and "profile" in g:
+        g.profile["sql_started"] = time.perf_counter()
+
+
+def _on_after_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and "profile" in g and "sql_started" in g.profile:
+        g.profile["sql_count"] += 1
+        g.profile["sql_ms"] += (time.perf_counter() - g.profile.pop("sql_started")) * 1000
+
+
+def setup_profiling(app):
+    if not env_flag("PROFILE_REQUESTS"):
+        return
+
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.INFO)
+
+    slow_ms = float(os.getenv("PROFILE_SLOW_MS", 500))
+    profile_dir = os.getenv("PROFILE_DIR", "/tmp/profiles")
+    sampler = StackSampler(float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 5)) / 1000)
+
+    event.listen(Engine, "before_cursor_execute", _on_before_execute)
+    event.listen(Engine, "after_cursor_execute", _on_after_execute)
+
+    # JSON encoding is timed by wrapping the provider, whatever provider the app uses
+    dumps = app.json.dumps
+
+    def timed_dumps(obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return dumps(obj, **kwargs)
+        finally:
+            if has_app_context() and "profile" in g:
+                g.profile["serialize_ms"] += (time.perf_counter() - started) * 1000
+
+    app.json.dumps = timed_dumps
+
+    @app.before_request
+    def start_profile():
+        g.profile = {"started": time.perf_counter(), "sql_count": 0, "sql_ms": 0.0, "serialize_ms": 0.0,
+                     "stacks": sampler.start(threading.get_ident())}
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+        total_ms = (time.perf_counter() - profile["started"]) * 1000
+
+        response.headers["Server-Timing"] = ", ".join([
+            f'db;dur={profile["sql_ms"]:.2f};desc="{profile["sql_count"]} queries"',
+            f'serialize;dur={profile["serialize_ms"]:.2f}',
+            f'total;dur={total_ms:.2f}',
+        ])
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "total_ms": round(total_ms, 2),
+            "sql_count": profile["sql_count"],
+            "sql_ms": round(profile["sql_ms"], 2),
+            "serialize_ms": round(profile["serialize_ms"], 2),
+        }))
+
+        if total_ms >= slow_ms and profile["stacks"]:
+            os.makedirs(profile_dir, exist_ok=True)
+            name = f"{int(time.time() * 1000)}-{request.method}-{request.endpoint}.folded"
+            with open(os.path.join(profile_dir, name), "w") as folded:
+                for stack, count in profile["stacks"].items():
+                    folded.write(f"{stack} {count}\n")
+        return response
+
+    @app.teardown_request
+    def stop_sampling(error):
+        # also runs when the view raised, after_request doesn't
+        sampler.stop(threading.get_ident())
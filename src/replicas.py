@@ -0,0 +1,149 @@
+"""
+Read replicas for the GET endpoints, configured with DATABASE_REPLICA_URLS (comma separated).
+
+Every replica is a Flask-SQLAlchemy bind (replica_0, replica_1...). The views decorated with
+@replica_reads take the next healthy replica in round robin, and their SELECTs run there.
+Everything else (writes, flushes, SELECT ... FOR UPDATE, every other view) stays on the primary.
+
+- health: a replica that raised a connection error, or lags more than REPLICA_MAX_LAG_SECONDS (30,
+  Postgres only), is left out until a check passes again. Checks run at most every
+  REPLICA_CHECK_SECONDS (5). With no healthy replica the reads go to the primary.
+- read your writes: a successful POST/PUT/PATCH/DELETE sets a cookie that sends the reads of
+  that client to the primary for READ_YOUR_WRITES_SECONDS (5), longer than the replication lag.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+
+logger = logging.getLogger(__name__)
+
+REPLICA_COOKIE = "read_primary_until"
+READ_YOUR_WRITES_SECONDS = int(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
+
+
+def replica_binds():
+    urls = [url.strip().replace("postgres://", "postgresql://")
+            for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    return {f"replica_{index}": url for index, url in enumerate(urls)}
+
+
+class RoutingSession(Session):
+    """Sends the SELECTs of a request that picked a replica to it, see replica_reads"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context():
+            replica = g.get("replica_engine")
+            # any SELECT, UNION ALL ones (CompoundSelect) included, unless it locks rows
+            if replica is not None and getattr(clause, "is_select", False) \
+                    and getattr(clause, "_for_update_arg", None) is None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _pass_clause(orm_execute_state):
+    # the ORM leaves the clause out of get_bind for a UNION ALL of ORM columns, without it
+    # RoutingSession can't tell the statement is a SELECT
+    if orm_execute_state.is_select:
+        orm_execute_state.bind_arguments.setdefault("clause", orm_execute_state.statement)
+
+
+class ReplicaRouter:
+
+    def __init__(self, engines):
+        self.engines = engines
+        self.check_interval = float(os.getenv("REPLICA_CHECK_SECONDS", 5))
+        self.max_lag = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 30))
+        self.healthy = {key: True for key in engines}
+        self.next_check = {key: 0.0 for key in engines}
+        self.order = itertools.cycle(list(engines))
+        self.lock = threading.Lock()
+        for key, engine in engines.items():
+            event.listen(engine, "handle_error", self._on_error(key))
+
+    def _on_error(self, key):
+        def on_error(context):
+            if context.is_disconnect or context.connection is None:
+                self.mark(key, False)
+        return on_error
+
+    def mark(self, key, healthy):
+        with self.lock:
+            if self.healthy[key] and not healthy:
+                logger.warning("replica %s is unhealthy, its reads go elsewhere", key)
+            self.healthy[key] = healthy
+            self.next_check[key] = time.monotonic() + self.check_interval
+
+    def check(self, key):
+        engine = self.engines[key]
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name == "postgresql":
+                    lag = connection.scalar(text(
+                        "SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())"))
+                    healthy = lag is None or lag <= self.max_lag
+                else:
+                    connection.execute(text("SELECT 1"))
+                    healthy = True
+        except Exception:
+            healthy = False
+        self.mark(key, healthy)
+        return healthy
+
+    def pick(self):
+        # the next replica in round robin that is (still) healthy, None when none of them is
+        for _ in range(len(self.engines)):
+            with self.lock:
+                key = next(self.order)
+                due = time.monotonic() >= self.next_check[key]
+                healthy = self.healthy[key]
+            if due:
+                healthy = self.check(key)
+            if healthy:
+                return self.engines[key]
+        return None
+
+    def stats(self):
+        return {key: "healthy" if healthy else "unhealthy" for key, healthy in self.healthy.items()}
+
+
+def reads_own_writes():
+    try:
+        return float(request.cookies.get(REPLICA_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def replica_reads(view):
+    """GET views whose SELECTs can be served by a replica"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        router = current_app.extensions.get("replicas")
+        if router is not None and request.method == "GET" and not reads_own_writes():
+            g.replica_engine = router.pick()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def setup_replicas(app, db):
+    keys = [key for key in app.config.get('SQLALCHEMY_BINDS', {}) if key.startswith("replica_")]
+    if not keys:
+        return
+    with app.app_context():
+        app.extensions["replicas"] = ReplicaRouter({key: db.engines[key] for key in keys})
+    # only with replicas: a do_orm_execute listener costs every ORM statement a second compile pass
+    if not event.contains(RoutingSession, "do_orm_execute", _pass_clause):
+        event.listen(RoutingSession, "do_orm_execute", _pass_clause)
+
+    @app.after_request
+    def remember_write(response):
+        if request.method in ("POST", "PUT", "PATCH", "DELETE") and response.status_code < 400:
+            until = time.time() + READ_YOUR_WRITES_SECONDS
+            response.set_cookie(REPLICA_COOKIE, f"{until:.3f}", max_age=READ_YOUR_WRITES_SECONDS,
+                                httponly=True, samesite="Lax")
+        return response
@@ -1,4 +1,23 @@
-from flask import jsonify, url_for
+import base64
+import binascii
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from functools import wraps
+from flask import Response, current_app, g, jsonify, make_response, request, stream_with_context, url_for
+from sqlalchemy import and_, event, or_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import load_only
+from sqlalchemy.pool import NullPool, QueuePool
+from models import get_versions
+from replicas import replica_binds
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+STREAM_BATCH_SIZE = 1000
+NDJSON_MIMETYPE = "application/x-ndjson"
 
 class APIException(Exception):
     status_code = 400
@@ -15,12 +34,316 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def env_flag(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+def configure_database(app):
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
+    else:
+        app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    # read replicas of the primary, see replicas.py
+    binds = {key: {"url": url, **engine_options(url)} for key, url in replica_binds().items()}
+    if binds:
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+def engine_options(database_uri):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS from env variables, the pool is per gunicorn worker so
+    DB_POOL_SIZE + DB_MAX_OVERFLOW times the number of workers must fit in max_connections
+    """
+    if database_uri.startswith("sqlite"):
+        # SQLite gets its tuning from the pragmas below, there is no server to pool connections to
+        return {}
+
+    options = {
+        "pool_pre_ping": env_flag("DB_POOL_PRE_PING", True),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+    }
+    if env_flag("DB_PGBOUNCER"):
+        # PgBouncer already pools the server connections, a second pool here only holds them hostage.
+        # It also rejects startup options, set statement_timeout on the role: ALTER ROLE ... SET statement_timeout
+        options["poolclass"] = NullPool
+        return options
+
+    options.update({
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", 30)),
+    })
+    statement_timeout = os.getenv("DB_STATEMENT_TIMEOUT")
+    if statement_timeout and database_uri.startswith("postgresql"):
+        options["connect_args"] = {"options": f"-c statement_timeout={int(statement_timeout)}"}
+    return options
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    # WAL lets the readers work while a writer commits, NORMAL sync is safe with WAL
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))}")
+    cursor.execute("PRAGMA cache_size=-20000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {"pid": os.getpid(), "pool": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            # no idle connection and no overflow left: the next checkout waits for pool_timeout
+            "exhausted": pool.checkedin() == 0 and pool.overflow() >= pool._max_overflow >= 0,
+        })
+    return stats
+
+def encode_cursor(values):
+    # the cursor is opaque for the clients, internally it's the last id of the page,
+    # or the list of sort values + id of the last row when the page has another order
+    if isinstance(values, list) and len(values) == 1:
+        values = values[0]
+    raw = str(values) if isinstance(values, int) else json.dumps(values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, columns):
+    # the values of columns the cursor carries, a cursor that encode_cursor() could not have made
+    # for them is rejected before it reaches a query (a string compared with an integer column...)
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise APIException("Invalid cursor", status_code=400)
+    values = values if isinstance(values, list) else [values]
+    if len(values) != len(columns) or not all(
+            type(value) is column.type.python_type for value, column in zip(values, columns)):
+        raise APIException("Invalid cursor", status_code=400)
+    return values
+
+def parse_fields(args, *models):
+    # ?fields=id,name -> ["id", "name"], None when every field is wanted (no ?fields=, or one
+    # that names none like ?fields=,): project() and serialize() must both read it as all of them
+    fields = [field.strip() for field in args.get("fields", "").split(",") if field.strip()]
+    if not fields:
+        return None
+    allowed = set().union(*(model.SERIALIZED_FIELDS for model in models))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise APIException("Unknown fields: " + ", ".join(unknown), status_code=400)
+    return fields
+
+def writable_fields(model):
+    computed = getattr(model, "COMPUTED_FIELDS", ())
+    return [column.key for column in model.__table__.columns if not column.primary_key and column.key not in computed]
+
+def row_values(model, body):
+    # every column but the primary key, for the writes that create or replace a whole row
+    if not isinstance(body, dict):
+        raise APIException("Expected a JSON object", status_code=400)
+    fields = writable_fields(model)
+    missing = [field for field in fields if field not in body]
+    if missing:
+        raise APIException("Missing fields: " + ", ".join(missing), status_code=400)
+    return {field: body[field] for field in fields}
+
+def patch_values(model, body):
+    # the columns a PATCH body changes. The id is ignored (it comes from the URL), any other key
+    # that isn't a column of the model is rejected
+    if not isinstance(body, dict):
+        raise APIException("Expected a JSON object", status_code=400)
+    fields = writable_fields(model)
+    values = {field: value for field, value in body.items() if field != "id"}
+    unknown = [field for field in values if field not in fields]
+    if unknown:
+        raise APIException("Unknown fields: " + ", ".join(unknown), status_code=400)
+    if not values:
+        raise APIException("Nothing to update", status_code=400)
+    return values
+
+def parse_include(args, allowed):
+    # ?include=favorites_planets -> ["favorites_planets"], all of them without the parameter, none with ?include=
+    if "include" not in args:
+        return list(allowed)
+    include = [name.strip() for name in args["include"].split(",") if name.strip()]
+    unknown = [name for name in include if name not in allowed]
+    if unknown:
+        raise APIException("Unknown include: " + ", ".join(unknown), status_code=400)
+    return include
+
+def project(query, model, fields, order=()):
+    # SELECT only the columns the requested fields (and the sort) read, the rest never leave the database
+    if fields is None:
+        return query
+    columns = {"id"}.union(*(model.SERIALIZED_FIELDS[field] for field in fields))
+    columns.update(column.key for column, _ in order)
+    return query.options(load_only(*[getattr(model, column) for column in columns]))
+
+def is_paginated(args):
+    return "limit" in args or "after" in args
+
+def paginate(query, model, args, order=()):
+    """
+    Keyset pagination: WHERE id > :after ORDER BY id LIMIT :limit, every page costs the same
+    index range scan no matter how deep it is (unlike OFFSET). With another order, like
+    [(Planets.population, True)], the id is added as tie breaker and the cursor carries both.
+    """
+    try:
+        limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise APIException("limit must be an integer", status_code=400)
+    if limit < 1:
+        raise APIException("limit must be greater than 0", status_code=400)
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    order = list(order)
+    if not any(column.key == "id" for column, _ in order):
+        order.append((model.id, False))
+    if args.get("after"):
+        values = decode_cursor(args["after"], [column for column, _ in order])
+        query = query.filter(after_keyset(order, values))
+
+    # fetch one extra row to know if there is a next page without a COUNT(*)
+    rows = ordered(query, order).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], encode_cursor([getattr(rows[limit - 1], column.key) for column, _ in order])
+
+def after_keyset(order, values):
+    # (a, b) > (x, y) spelled out, so every column can go in its own direction
+    conditions = []
+    for position, (column, descending) in enumerate(order):
+        equal = [order[i][0] == values[i] for i in range(position)]
+        after = column < values[position] if descending else column > values[position]
+        conditions.append(and_(*equal, after))
+    return or_(*conditions)
+
+def ordered(query, order):
+    return query.order_by(*[column.desc() if descending else column.asc() for column, descending in order])
+
+def wants_stream(request):
+    if request.args.get("stream") in ("1", "true"):
+        return True
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def stream_response(request, queries, serialize=lambda row: row.serialize()):
+    """
+    Streams one query as a JSON array, or a dict of queries as a JSON object of arrays
+    (like {"planets": [...], "people": [...]}). With Accept: application/x-ndjson every row
+    goes on its own line instead. Rows are read with yield_per (a server side cursor on Postgres)
+    and written in batches, so memory stays flat and the first bytes leave right away.
+    """
+    ndjson = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+    sections = queries if isinstance(queries, dict) else {None: queries}
+    provider = current_app.json
+
+    def dumps(obj):
+        # compact like jsonify, so a streamed body has the same bytes as the buffered one
+        return provider.dumps(obj, separators=(",", ":"))
+
+    def generate():
+        if not ndjson and None not in sections:
+            yield "{"
+        for position, (key, query) in enumerate(sections.items()):
+            if not ndjson:
+                if key is not None:
+                    yield ("," if position else "") + dumps(key) + ":"
+                yield "["
+            separator = ""
+            buffer = []
+            for row in query.yield_per(STREAM_BATCH_SIZE):
+                item = serialize(row)
+                if ndjson:
+                    if key is not None:
+                        item["type"] = key
+                    buffer.append(dumps(item) + "\n")
+                else:
+                    buffer.append(separator + dumps(item))
+                    separator = ","
+                if len(buffer) >= STREAM_BATCH_SIZE:
+                    yield "".join(buffer)
+                    buffer = []
+            if buffer:
+                yield "".join(buffer)
+            if not ndjson:
+                yield "]"
+        if not ndjson and None not in sections:
+            yield "}"
+
+    mimetype = NDJSON_MIMETYPE if ndjson else "application/json"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+def conditional(*tables):
+    """
+    Strong ETags for GET endpoints built from the version markers of the tables the response
+    reads from. A matching If-None-Match gets a 304 after a single tiny query, before the view
+    touches the rows or serializes anything.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = get_versions(tables)
+            # the response cache keys on them too, see ResponseCache.cached
+            g.table_versions = versions
+            fingerprint = f"{request.full_path}|{versions}|{request.accept_mimetypes}|" \
+                f"{request.accept_encodings}"
+            etag = hashlib.sha1(fingerprint.encode()).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+class LazyMount:
+    """
+    WSGI middleware sending every path under `prefix` to the app returned by `factory`,
+    which is only called (and its modules imported) on the first request there
+    """
+
+    def __init__(self, wsgi_app, prefix, factory):
+        self.wsgi_app = wsgi_app
+        self.prefix = prefix.rstrip("/")
+        self.factory = factory
+        self.mounted = None
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path != self.prefix and not path.startswith(self.prefix + "/"):
+            return self.wsgi_app(environ, start_response)
+        if self.mounted is None:
+            with self.lock:
+                if self.mounted is None:
+                    self.mounted = self.factory()
+        return self.mounted(environ, start_response)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
+    # the routes don't change once the app is serving, the HTML is built on the first call only
+    if "sitemap" not in app.extensions:
+        app.extensions["sitemap"] = build_sitemap(app)
+    return app.extensions["sitemap"]
+
+def build_sitemap(app):
     links = ['/admin/']
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
@@ -0,0 +1,31 @@
+# Runs the background jobs of jobs.py, next to the web workers of wsgi.py:
+#
+#     $ python src/worker.py [--concurrency 2] [--burst]
+#
+# --concurrency (JOB_CONCURRENCY) jobs run at once, each one in a thread holding a database
+# connection, keep it under DB_POOL_SIZE + DB_MAX_OVERFLOW. --burst stops once no job is due.
+# SIGTERM and SIGINT let the running jobs finish, then the worker exits.
+import argparse
+import os
+import signal
+import threading
+
+from app import create_app
+from jobs import work
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("JOB_CONCURRENCY", 2)))
+    parser.add_argument("--burst", action="store_true", help="exit once no job is due")
+    args = parser.parse_args()
+
+    application = create_app()
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    work(application, args.concurrency, stop, burst=args.burst)
+
+
+if __name__ == "__main__":
+    main()